@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Licensed under the GNU General Public License, version 3 or higher.
+
+"""usage: python bench/record_memory.py [nrecords]
+
+Measure the memory taken by parsed records, as `inifile.Record`s and as the
+plain `Holder`s that were used before them, on a synthetic corpus whose
+records have varying sets of keys in varying orders, as in real datadirs.
+Each record is also passed through `worklog.decode_fields`, as `load` does.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import gc
+import io
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import inifile
+from inifile import Holder
+from worklog import decode_fields
+
+KEYS = [
+    "title",
+    "authors",
+    "mypos",
+    "pubdate",
+    "refereed",
+    "bibcode",
+    "arxiv",
+    "doi",
+    "cite",
+    "adscites",
+    "url",
+    "kind",
+]
+
+VALUES = {
+    "mypos": "2",
+    "pubdate": "2020/05",
+    "refereed": "y",
+    "adscites": "2023/01/01 5",
+}
+
+
+def make_corpus(n, seed=1):
+    rng = random.Random(seed)
+    lines = []
+
+    for i in range(n):
+        keys = KEYS[:6] + rng.sample(KEYS[6:], rng.randint(0, 6))
+        rng.shuffle(keys)
+        lines.append("[pub]\n")
+
+        for k in keys:
+            lines.append("%s = %s\n" % (k, VALUES.get(k, "%s-%d" % (k, i))))
+
+        lines.append("\n")
+
+    return "".join(lines)
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    items = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del items
+    return size
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 50000
+    text = make_corpus(n)
+
+    def records():
+        return [
+            decode_fields(r) for r in inifile.readStream(io.StringIO(text))
+        ]
+
+    def read_holders():
+        # This is how readStream built records before Records existed.
+        h = None
+
+        for kind, a, b in inifile._scan(io.StringIO(text)):
+            if kind == inifile._VALUE:
+                h.setone(a, b)
+            elif kind == inifile._SECTION:
+                if h is not None:
+                    yield h
+                h = Holder()
+                h.section = b
+
+        if h is not None:
+            yield h
+
+    def holders():
+        return [decode_fields(h) for h in read_holders()]
+
+    inifile._layouts.clear()
+    rsize = measure(records)
+    nlayouts = len(inifile._layouts)
+    nentries = sum(len(l[1]) for l in inifile._layouts.values())
+    hsize = measure(holders)
+
+    print("%d records with mixed key sets and orders" % n)
+    print("  Holders: %6.1f MB" % (hsize / 1e6))
+    print(
+        "  Records: %6.1f MB (%d layouts, %d layout entries)"
+        % (rsize / 1e6, nlayouts, nentries)
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv)
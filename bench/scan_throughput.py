@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Licensed under the GNU General Public License, version 3 or higher.
+
+"""usage: python bench/scan_throughput.py [nrecords] [nauthors]
+
+Measure the parsing throughput of `inifile.readStream` and
+`inifile.mutateStream` on records with very long, wrapped author lists, and
+compare it to the line-by-line parser that preceded the shared `_scan`
+tokenizer (reproduced below as `old_read_stream`), which appended to each
+multi-line value one line at a time.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import inifile
+from inifile import Holder, escre, keyre, sectionre
+
+
+def old_read_stream(stream):
+    section = None
+    key = None
+    data = None
+
+    for fullline in stream:
+        line = fullline.split("#", 1)[0]
+
+        m = sectionre.match(line)
+        if m is not None:
+            if section is not None:
+                if key is not None:
+                    section.setone(key, data.strip())
+                    key = data = None
+                yield section
+
+            section = Holder()
+            section.section = m.group(1)
+            continue
+
+        if len(line.strip()) == 0:
+            if key is not None:
+                section.setone(key, data.strip())
+                key = data = None
+            continue
+
+        m = escre.match(fullline)
+        if m is not None:
+            if key is not None:
+                section.setone(key, data.strip())
+            key = m.group(1)
+            data = (
+                m.group(2)
+                .replace(r"\"", '"')
+                .replace(r"\n", "\n")
+                .replace(r"\\", "\\")
+            )
+            section.setone(key, data)
+            key = data = None
+            continue
+
+        m = keyre.match(line)
+        if m is not None:
+            if key is not None:
+                section.setone(key, data.strip())
+            key = m.group(1)
+            data = m.group(2)
+            if not len(data):
+                data = " "
+            elif data[-1] not in " \t\r\n":
+                data += " "
+            continue
+
+        if line[0] in " \t" and key is not None:
+            data += line.strip() + " "
+            continue
+
+        raise Exception("unparsable line: " + line[:-1])
+
+    if section is not None:
+        if key is not None:
+            section.setone(key, data.strip())
+        yield section
+
+
+def make_corpus(nrecords, nauthors):
+    lines = []
+
+    for i in range(nrecords):
+        lines.append("[pub]\n")
+        lines.append("title = A paper with many authors, number %d\n" % i)
+        lines.append("authors = A. Author0")
+
+        for j in range(1, nauthors):
+            if j % 5 == 0:
+                lines.append(";\n  B.C. Author%d" % j)
+            else:
+                lines.append("; B.C. Author%d" % j)
+
+        lines.append("\nmypos = 3\npubdate = 2020/01\n\n")
+
+    return "".join(lines)
+
+
+def best_time(func, text, repeats=3):
+    best = None
+
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        func(text)
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def main(argv):
+    nrecords = int(argv[1]) if len(argv) > 1 else 200
+    nauthors = int(argv[2]) if len(argv) > 2 else 3000
+    text = make_corpus(nrecords, nauthors)
+    mb = len(text.encode("utf-8")) / 1e6
+
+    def old_read(text):
+        return list(old_read_stream(io.StringIO(text)))
+
+    def new_read(text):
+        return list(inifile.readStream(io.StringIO(text)))
+
+    def new_mutate(text):
+        out = io.StringIO()
+        for chunk in inifile.mutateStream(io.StringIO(text), out):
+            pass
+        return out
+
+    # The two parsers must agree before their speeds are worth comparing.
+    old = [sorted(h.iteritems()) for h in old_read(text)]
+    new = [sorted(r.iteritems()) for r in new_read(text)]
+    assert old == new, "parsers disagree"
+
+    print(
+        "%d records with %d-author wrapped author lists (%.1f MB)"
+        % (nrecords, nauthors, mb)
+    )
+
+    for name, func in [
+        ("old readStream", old_read),
+        ("readStream", new_read),
+        ("mutateStream", new_mutate),
+    ]:
+        t = best_time(func, text)
+        print("  %-15s %6.3f s (%5.1f MB/s)" % (name, t, mb / t))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
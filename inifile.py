@@ -10,7 +10,7 @@ from six.moves import range
 
 import io
 
-__all__ = ('Holder readStream read FileChunk '
+__all__ = ('Holder Record readStream read recordOffsets FileChunk '
            'mutateStream mutate mutateInPlace').split()
 
 
@@ -57,75 +57,284 @@ class Holder(object):
             yield k, v
 
 
+# Parsed data files can contain tens of thousands of records, and a Holder
+# carries a full __dict__ for each one. Records hold the same information more
+# compactly: all records of the same section with the same set of keys share
+# a single key-to-index table (a "layout"), and each record only stores a list
+# of values. A record's layout is fixed when it's created, so the number of
+# layouts is bounded by the number of distinct key sets in the data, whatever
+# order the keys come in. Keys added one at a time afterwards go in a small
+# per-record overflow dict; a batch of new keys (e.g. from
+# `worklog.decode_fields`) moves the record to the layout for its new key set. Records
+# support the Holder API, and copy() returns a plain Holder, so code that
+# decorates copies of records is unaffected.
+
+_layouts = {}
+
+def _layoutFor(section, keys):
+    """Return the layout for records of `section` with the sorted tuple of
+    keys `keys`."""
+    layout = _layouts.get((section, keys))
+    if layout is None:
+        layout = (keys, dict((k, i) for i, k in enumerate(keys)))
+        _layouts[section, keys] = layout
+    return layout
+
+
+def _rebuildRecord(section, keys, values, extra):
+    rec = object.__new__(Record)
+    object.__setattr__(rec, '_layout', _layoutFor(section, keys))
+    object.__setattr__(rec, '_values', values)
+    object.__setattr__(rec, '_extra', extra)
+    return rec
+
+
+class Record(object):
+    __slots__ = ('_layout', '_values', '_extra')
+
+    def __init__(self, **kwargs):
+        keys = tuple(sorted(kwargs))
+        object.__setattr__(self, '_layout',
+                           _layoutFor(kwargs.get('section'), keys))
+        object.__setattr__(self, '_values', [kwargs[k] for k in keys])
+        object.__setattr__(self, '_extra', None)
+
+    def __reduce__(self):
+        return _rebuildRecord, (self.get('section'), self._layout[0],
+                                self._values, self._extra)
+
+    def __getattr__(self, name):
+        idx = self._layout[1].get(name)
+        if idx is not None:
+            return self._values[idx]
+        if self._extra is not None and name in self._extra:
+            return self._extra[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self.setone(name, value)
+
+    def _asdict(self):
+        d = dict(zip(self._layout[0], self._values))
+        if self._extra is not None:
+            d.update(self._extra)
+        return d
+
+    def __str__(self):
+        d = self._asdict()
+        s = sorted(d.keys())
+        return '{' + ', '.join('%s=%s' % (k, d[k]) for k in s) + '}'
+
+    def __repr__(self):
+        d = self._asdict()
+        s = sorted(d.keys())
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join('%s=%r' % (k, d[k]) for k in s))
+
+    def set(self, **kwargs):
+        index = self._layout[1]
+
+        if sum(1 for k in kwargs if k not in index) > 1:
+            # Several new keys at once (as from `worklog.decode_fields`): move
+            # to the shared layout for the full key set rather than giving
+            # every record an overflow dict.
+            fields = self._asdict()
+            fields.update(kwargs)
+            keys = tuple(sorted(fields))
+            object.__setattr__(self, '_layout',
+                               _layoutFor(fields.get('section'), keys))
+            object.__setattr__(self, '_values', [fields[k] for k in keys])
+            object.__setattr__(self, '_extra', None)
+            return self
+
+        for k, v in kwargs.items():
+            self.setone(k, v)
+        return self
+
+    def get(self, name, defval=None):
+        idx = self._layout[1].get(name)
+        if idx is not None:
+            return self._values[idx]
+        if self._extra is not None:
+            return self._extra.get(name, defval)
+        return defval
+
+    def setone(self, name, value):
+        idx = self._layout[1].get(name)
+
+        if idx is not None:
+            self._values[idx] = value
+        elif self._extra is None:
+            object.__setattr__(self, '_extra', {name: value})
+        else:
+            self._extra[name] = value
+        return self
+
+    def has(self, name):
+        return (name in self._layout[1] or
+                (self._extra is not None and name in self._extra))
+
+    def copy(self):
+        new = Holder()
+        new.__dict__ = self._asdict()
+        return new
+
+    def iteritems(self):
+        for k, v in self._asdict().items():
+            if k[0] == '_':
+                continue
+            if v is None:
+                continue
+            yield k, v
+
+
 import re, os
 
 sectionre = re.compile(r'^\[(.*)]\s*$')
 keyre = re.compile(r'^(\S+)\s*= (.*)$') # leading space chomped later
 escre = re.compile(r'^(\S+)\s*=\s*"(.*)"\s*$')
 
-def readStream(stream):
-    section = None
+# Events generated by _scan():
+_SECTION = 0 # (_SECTION, fullline, section name)
+_LINE = 1 # (_LINE, fullline, associated key or None)
+_VALUE = 2 # (_VALUE, key, value): a key's value is now complete
+
+def _scan(stream, sections=None):
+    """Tokenize an ini file, classifying each line by its first character so
+    that each line costs at most one or two regex matches. Multi-line values
+    are accumulated in lists and joined once they're complete, so that very
+    long values (e.g. author lists with thousands of entries) don't take
+    quadratic time.
+
+    If `sections` is not None, records whose section name isn't in it are
+    skipped: their bodies are passed over without being tokenized at all, and
+    no events are generated for them."""
+
+    insection = False
+    skipping = False
     key = None
-    data = None
+    parts = None
 
     for fullline in stream:
+        if skipping and fullline[:1] != '[':
+            continue
+
         line = fullline.split('#', 1)[0]
+        c = line[:1]
 
-        m = sectionre.match(line)
-        if m is not None:
-            # New section
-            if section is not None:
+        if c == '[':
+            m = sectionre.match(line)
+            if m is not None:
                 if key is not None:
-                    section.setone(key, data.strip())
-                    key = data = None
-                yield section
+                    yield _VALUE, key, ''.join(parts).strip()
+                    key = parts = None
+                insection = True
+                skipping = sections is not None and m.group(1) not in sections
+                if not skipping:
+                    yield _SECTION, fullline, m.group(1)
+                continue
 
-            section = Holder()
-            section.section = m.group(1)
+        if skipping:
             continue
 
-        if len(line.strip()) == 0:
-            if key is not None:
-                section.setone(key, data.strip())
-                key = data = None
-            continue
+        if not c or c.isspace():
+            if not line.strip():
+                if key is not None:
+                    yield _VALUE, key, ''.join(parts).strip()
+                    key = parts = None
+                yield _LINE, fullline, None
+                continue
+
+            if c in ' \t' and key is not None:
+                parts.append(line.strip() + ' ')
+                yield _LINE, fullline, key
+                continue
+
+            raise Exception('unparsable line: ' + line[:-1])
+
+        if fullline.rstrip().endswith('"'):
+            m = escre.match(fullline)
+        else:
+            m = None
 
-        m = escre.match(fullline)
         if m is not None:
-            if section is None:
+            if not insection:
                 raise Exception('key seen without section!')
             if key is not None:
-                section.setone(key, data.strip())
-            key = m.group(1)
+                yield _VALUE, key, ''.join(parts).strip()
+                key = parts = None
             data = m.group(2).replace(r'\"', '"').replace(r'\n', '\n').replace(r'\\', '\\')
-            section.setone(key, data)
-            key = data = None
+            yield _VALUE, m.group(1), data
+            yield _LINE, fullline, m.group(1)
             continue
 
         m = keyre.match(line)
         if m is not None:
-            if section is None:
+            if not insection:
                 raise Exception('key seen without section!')
             if key is not None:
-                section.setone(key, data.strip())
+                yield _VALUE, key, ''.join(parts).strip()
             key = m.group(1)
             data = m.group(2)
             if not len(data):
                 data = ' '
             elif data[-1] not in ' \t\r\n':
                 data += ' '
+            parts = [data]
+            yield _LINE, fullline, key
             continue
 
-        if line[0] in ' \t' and key is not None:
-            data += line.strip() + ' '
+        raise Exception('unparsable line: ' + line[:-1])
+
+    if key is not None:
+        yield _VALUE, key, ''.join(parts).strip()
+
+
+def readStream(stream, sections=None):
+    """Yield a Record for each record in `stream`. If `sections` is not None,
+    only records whose section names are in it are parsed and yielded."""
+    fields = None
+
+    for kind, a, b in _scan(stream, sections):
+        if kind == _VALUE:
+            fields[a] = b
+        elif kind == _SECTION:
+            if fields is not None:
+                yield Record(**fields)
+
+            fields = {'section': b}
+
+    if fields is not None:
+        yield Record(**fields)
+
+
+_bheaderre = re.compile(br'^\[[^\n]*', re.M)
+_bsectionre = re.compile(br'^\[(.*)]\s*$')
+
+def recordOffsets(raw):
+    """Split the raw bytes of an ini file into ranges that can each be parsed
+    on their own: one starting at each section header, plus one at the very
+    beginning for anything preceding the first header. Returns a list of
+    `(offset, length, section)` tuples that together cover all of `raw`, where
+    `section` is the name in the range's header (None for the leading range).
+    Parsing the ranges separately and concatenating the results is equivalent
+    to parsing the whole thing."""
+
+    starts = [(0, None)]
+
+    for m in _bheaderre.finditer(raw):
+        sm = _bsectionre.match(m.group(0).split(b'#', 1)[0])
+        if sm is None:
             continue
 
-        raise Exception('unparsable line: ' + line[:-1])
+        name = sm.group(1).decode('utf-8', 'replace')
+        if m.start() == 0:
+            starts[0] = (0, name)
+        else:
+            starts.append((m.start(), name))
 
-    if section is not None:
-        if key is not None:
-            section.setone(key, data.strip())
-        yield section
+    ends = [s[0] for s in starts[1:]] + [len(raw)]
+    return [(ofs, end - ofs, name) for (ofs, name), end in zip(starts, ends)]
 
 
 def read(stream_or_path):
@@ -167,66 +376,96 @@ def write(stream_or_path, items):
 # hasn't been thoroughly tested, and it's a little hairy ...
 
 class FileChunk(object):
+    """One record of a file being mutated, along with the lines that make it
+    up. We keep an index from each key to the lines holding its value, and
+    note where lines for brand-new keys should go (after the last keyed line,
+    or after the section header if there are none), so that set() costs the
+    same no matter how large the chunk is. New lines are held aside in
+    `_added` and spliced in by emit(). The `dirty` flag records whether set()
+    has actually changed anything."""
+
     def __init__(self):
         self.data = Holder()
         self._lines = []
+        self._index = {}
+        self._headerAt = 0
+        self._insertAt = 0
+        self._added = []
+        self._addedIndex = {}
+        self.dirty = False
 
 
     def _addLine(self, line, assoc):
+        if assoc is not None:
+            self._index.setdefault(assoc, []).append(len(self._lines))
+            self._insertAt = len(self._lines)
         self._lines.append((assoc, line))
 
 
     def set(self, name, value):
         newline = (u'%s = %s' % (name, value)) + os.linesep
-        first = True
+        idxs = self._index.get(name)
 
-        for i in range(len(self._lines)):
-            assoc, line = self._lines[i]
+        if idxs is not None:
+            if len(idxs) == 1 and self._lines[idxs[0]][1] == newline:
+                return
 
-            if assoc != name:
-                continue
+            self.dirty = True
+            self._lines[idxs[0]] = (name, newline)
 
-            if first:
-                self._lines[i] = (assoc, newline)
-                first = False
-            else:
+            for i in idxs[1:]:
                 # delete the line
                 self._lines[i] = (None, None)
 
-        if first:
+            del idxs[1:]
+
+            if not self._added and self._lines[self._insertAt][0] is None:
+                # We deleted the last keyed line; back up to the new last one.
+                i = self._insertAt
+                while i > self._headerAt and self._lines[i][0] is None:
+                    i -= 1
+                self._insertAt = i
+            return
+
+        self.dirty = True
+        i = self._addedIndex.get(name)
+
+        if i is not None:
+            self._added[i] = newline
+        else:
             # Need to append the line to the last block
-            for i in range(len(self._lines) - 1, -1, -1):
-                if self._lines[i][0] is not None:
-                    break
+            self._addedIndex[name] = len(self._added)
+            self._added.append(newline)
 
-            self._lines.insert(i + 1,(name, newline))
+
+    def set_many(self, **kwargs):
+        """Apply several updates at once; equivalent to calling set() for each
+        keyword argument in order."""
+
+        for name, value in kwargs.items():
+            self.set(name, value)
 
 
     def emit(self, stream):
-        for assoc, line in self._lines:
-            if line is None:
-                continue
-            #print(line)
+        for i, (assoc, line) in enumerate(self._lines):
+            if line is not None:
+                stream.write(line)
 
-            stream.write(line)
+            if i == self._insertAt:
+                for added in self._added:
+                    stream.write(added)
 
 
 def mutateStream(instream, outstream):
     chunk = None
-    key = None
-    data = None
     misclines = []
 
-    for fullline in instream:
-        line = fullline.split('#', 1)[0]
-
-        m = sectionre.match(line)
-        if m is not None:
+    for kind, a, b in _scan(instream):
+        if kind == _VALUE:
+            chunk.data.setone(a, b)
+        elif kind == _SECTION:
             # New chunk
             if chunk is not None:
-                if key is not None:
-                    chunk.data.setone(key, data.strip())
-                    key = data = None
                 yield chunk
                 chunk.emit(outstream)
 
@@ -234,56 +473,15 @@ def mutateStream(instream, outstream):
             for miscline in misclines:
                 chunk._addLine(miscline, None)
             misclines = []
-            chunk.data.section = m.group(1)
-            chunk._addLine(fullline, None)
-            continue
-
-        if len(line.strip()) == 0:
-            if key is not None:
-                chunk.data.setone(key, data.strip())
-                key = data = None
-            if chunk is not None:
-                chunk._addLine(fullline, None)
-            else:
-                misclines.append(fullline)
-            continue
-
-        m = escre.match(fullline)
-        if m is not None:
-            if chunk is None:
-                raise Exception('key seen without section!')
-            if key is not None:
-                chunk.data.setone(key, data.strip())
-            key = m.group(1)
-            data = m.group(2).replace(r'\"', '"').replace(r'\n', '\n').replace(r'\\', '\\')
-            chunk.data.setone(key, data)
-            chunk._addLine(fullline, key)
-            key = data = None
-            continue
-
-        m = keyre.match(line)
-        if m is not None:
-            if chunk is None:
-                raise Exception('key seen without section!')
-            if key is not None:
-                chunk.data.setone(key, data.strip())
-            key = m.group(1)
-            data = m.group(2)
-            if not len(data) or not data[-1].isspace():
-                data += ' '
-            chunk._addLine(fullline, key)
-            continue
-
-        if line[0].isspace() and key is not None:
-            data += line.strip() + ' '
-            chunk._addLine(fullline, key)
-            continue
-
-        raise Exception('unparsable line: ' + line[:-1])
+            chunk.data.section = b
+            chunk._addLine(a, None)
+            chunk._headerAt = chunk._insertAt = len(chunk._lines) - 1
+        elif chunk is not None:
+            chunk._addLine(a, b)
+        else:
+            misclines.append(a)
 
     if chunk is not None:
-        if key is not None:
-            chunk.data.setone(key, data.strip())
         yield chunk
         chunk.emit(outstream)
 
@@ -302,22 +500,38 @@ def mutate(instream_or_path, outstream_or_path, outmode='w'):
     return mutateStream(instream_or_path, outstream_or_path)
 
 
-def mutateInPlace(inpath):
-    from sys import exc_info
+def mutateInPlace(inpath, stats=None):
+    """Mutate the file at `inpath`, yielding a FileChunk for each record. If no
+    chunk was actually changed, the file is left completely untouched, so its
+    modification time doesn't change. If `stats` is not None, it should be a
+    Holder with integer fields `rewritten` and `unchanged`; one of them is
+    incremented once the file has been processed."""
     from os import rename, unlink
 
     tmppath = inpath + '.new'
+    buf = io.StringIO()
+    dirty = False
 
     with io.open(inpath, 'rt') as instream:
+        for item in mutateStream(instream, buf):
+            yield item
+            dirty = dirty or item.dirty
+
+    if not dirty:
+        if stats is not None:
+            stats.unchanged += 1
+        return
+
+    try:
+        with io.open(tmppath, 'wt') as outstream:
+            outstream.write(buf.getvalue())
+        rename(tmppath, inpath)
+    except:
         try:
-            with io.open(tmppath, 'wt') as outstream:
-                for item in mutateStream(instream, outstream):
-                    yield item
-                rename(tmppath, inpath)
-        except:
-            et, ev, etb = exc_info()
-            try:
-                os.unlink(tmppath)
-            except Exception:
-                pass
-            raise et(ev).with_traceback(etb)
+            unlink(tmppath)
+        except Exception:
+            pass
+        raise
+
+    if stats is not None:
+        stats.rewritten += 1
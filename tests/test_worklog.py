@@ -0,0 +1,188 @@
+# -*- mode: python; coding: utf-8 -*-
+# Licensed under the GNU General Public License, version 3 or higher.
+
+"""Tests of the record parsing, the parse cache, and the update-cites
+scheduler. Run with "python -m pytest" from the top of the package."""
+
+from __future__ import absolute_import, division, print_function
+
+import io
+import os
+import sys
+from importlib.machinery import SourceFileLoader
+from importlib.util import module_from_spec, spec_from_loader
+
+TOPDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, TOPDIR)
+
+import inifile
+from inifile import Holder
+from wlcache import ParseCache
+
+SAMPLE = """\
+# A comment before the first record.
+[pub]
+title = First paper
+authors = A. Author; B. Author;
+  C. Author  # wrapped
+pubdate = 2020/03
+
+[talk]
+title = "A \\"quoted\\" title"
+date = 2021 Jun
+"""
+
+
+def load_wltool():
+    # wltool is a script without a .py extension, so import it by hand.
+    loader = SourceFileLoader("wltool", os.path.join(TOPDIR, "wltool"))
+    module = module_from_spec(spec_from_loader("wltool", loader))
+    loader.exec_module(module)
+    return module
+
+
+def write(path, text):
+    with io.open(path, "wt") as f:
+        f.write(text)
+
+
+def read(path):
+    with io.open(path, "rt") as f:
+        return f.read()
+
+
+def test_read_stream():
+    recs = list(inifile.readStream(io.StringIO(SAMPLE)))
+
+    assert [r.section for r in recs] == ["pub", "talk"]
+    assert recs[0].authors == "A. Author; B. Author; C. Author"
+    assert recs[0].pubdate == "2020/03"
+    assert recs[1].title == 'A "quoted" title'
+    assert not recs[1].has("authors")
+
+
+def test_mutate_in_place_untouched(tmp_path):
+    path = str(tmp_path / "2020.txt")
+    write(path, SAMPLE)
+    mtime = os.stat(path).st_mtime_ns
+    stats = Holder(rewritten=0, unchanged=0)
+
+    for item in inifile.mutateInPlace(path, stats):
+        pass
+
+    assert read(path) == SAMPLE
+    assert os.stat(path).st_mtime_ns == mtime
+    assert (stats.rewritten, stats.unchanged) == (0, 1)
+
+
+def test_mutate_in_place_round_trip(tmp_path):
+    path = str(tmp_path / "2020.txt")
+    write(path, SAMPLE)
+    stats = Holder(rewritten=0, unchanged=0)
+
+    for item in inifile.mutateInPlace(path, stats):
+        if item.data.section == "pub":
+            item.set("adscites", "2024/01/02 7")
+
+    assert (stats.rewritten, stats.unchanged) == (1, 0)
+
+    text = read(path)
+    assert "# A comment before the first record." in text
+    assert "  C. Author  # wrapped" in text
+    assert not os.path.exists(path + ".new")
+
+    before = list(inifile.readStream(io.StringIO(SAMPLE)))
+    after = list(inifile.read(path))
+    assert after[0].adscites == "2024/01/02 7"
+    assert after[0].authors == before[0].authors
+    assert after[1].title == before[1].title
+
+
+def test_parse_cache_staleness(tmp_path):
+    datadir = str(tmp_path)
+    path = os.path.join(datadir, "2020.txt")
+    write(path, SAMPLE)
+
+    pcache = ParseCache(datadir)
+    first = pcache.load_many([path])[0]
+    assert (pcache.n_hits, pcache.n_misses) == (0, 1)
+
+    pcache = ParseCache(datadir)
+    second = pcache.load_many([path])[0]
+    assert pcache.n_hits == 1 and pcache.n_misses == 0
+    assert [r.title for r in second] == [r.title for r in first]
+
+    # Same size, different contents and mtime: must be re-parsed.
+    write(path, SAMPLE.replace("First", "Final"))
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    pcache = ParseCache(datadir)
+    third = pcache.load_many([path])[0]
+    assert pcache.n_hits == 0 and pcache.n_misses == 1
+    assert third[0].title == "Final paper"
+
+
+DAY = 86400
+WEEK = 7 * DAY
+
+
+def make_candidate(
+    name, lastupdate, cites=0, prevupdate=None, prevcites=None, pubtime=None
+):
+    return Holder(
+        bibcode=name,
+        lastupdate=lastupdate,
+        cites=cites,
+        prevupdate=prevupdate,
+        prevcites=prevcites,
+        pubtime=pubtime,
+    )
+
+
+def schedule_candidates(now):
+    return [
+        # Checked yesterday: not due.
+        make_candidate("recent", now - DAY, 10, now - 2 * DAY, 5),
+        # Old and quiet, checked two months ago: backed off, not due.
+        make_candidate(
+            "quiet", now - 60 * DAY, 3, now - 120 * DAY, 3, now - 3000 * DAY
+        ),
+        # Gaining a citation a day, checked two weeks ago.
+        make_candidate(
+            "lively", now - 2 * WEEK, 50, now - 3 * WEEK, 43, now - 400 * DAY
+        ),
+        # Gaining a citation a week, so due every five weeks; checked six
+        # weeks ago.
+        make_candidate(
+            "steady", now - 6 * WEEK, 20, now - 7 * WEEK, 19, now - 400 * DAY
+        ),
+        # Gaining a citation a week too, but checked four weeks ago.
+        make_candidate(
+            "early", now - 4 * WEEK, 20, now - 5 * WEEK, 19, now - 400 * DAY
+        ),
+        # Never checked at all.
+        make_candidate("new", 0),
+    ]
+
+
+def test_schedule_order():
+    wltool = load_wltool()
+    now = 1700000000
+    chosen, n_deferred = wltool._schedule_cite_updates(
+        schedule_candidates(now), now
+    )
+
+    assert [c.bibcode for c in chosen] == ["new", "lively", "steady"]
+    assert n_deferred == 0
+
+
+def test_schedule_budget():
+    wltool = load_wltool()
+    now = 1700000000
+    chosen, n_deferred = wltool._schedule_cite_updates(
+        schedule_candidates(now), now, limit=2
+    )
+
+    assert [c.bibcode for c in chosen] == ["new", "lively"]
+    assert n_deferred == 1
@@ -0,0 +1,582 @@
+# -*- mode: python; coding: utf-8 -*-
+# Licensed under the GNU General Public License, version 3 or higher.
+
+"""A client for the NASA ADS API.
+
+All requests go through one `requests.Session`, so that TLS connections are
+pooled and reused rather than set up anew for every request. Independent
+requests can be run concurrently by a bounded pool of worker threads (see
+`ADSClient.map`). Responses that indicate a transient problem (HTTP 429 and
+5xx statuses, or a failure to connect at all) are retried with exponential
+backoff and random jitter, honoring any Retry-After header, and requests are
+never started faster than a fixed ceiling rate, so that we stay on the good
+side of ADS's rate limits. The latency of every request is recorded for
+reporting, as is the remaining request quota that ADS reports in its
+rate-limit headers for each endpoint.
+
+Citation counts can also be kept in an `ADSCache`, an SQLite database shared
+by all of the user's datadirs and processes (by default in
+`$XDG_CACHE_HOME/worklog-tools`), so that the same bibcode isn't fetched over
+and over by different people's runs, or by a run that's restarted after a
+crash. The database is used in WAL mode, so that readers and a writer don't
+block each other, and every update is its own short transaction. Its size is
+capped, with the least-recently-fetched counts evicted first.
+
+Within one datadir, a `CiteJournal` records each count as soon as it is
+fetched, so that if an update run is interrupted before it gets to write the
+counts into the data files, the next run can pick up where it left off.
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import io
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+__all__ = str(
+    "ADSCache ADSClient ADSCountError ADSQuotaDeferral CiteJournal"
+).split()
+
+API_BASE = "https://api.adsabs.harvard.edu/v1/"
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class ADSCountError(Exception):
+    def __init__(self, fmt, *args):
+        super(ADSCountError, self).__init__(fmt % args)
+
+
+class ADSQuotaDeferral(ADSCountError):
+    """A count that wasn't asked for, to spare an API quota; unlike other
+    ADSCountErrors, it says nothing about the bibcode."""
+
+
+class ADSClient(object):
+    """A connection to the ADS API, authenticated with `token`. At most
+    `max_workers` requests are in flight at once, and at most `max_rate` are
+    started per second (if it isn't None). A request that fails transiently
+    is attempted up to `max_retries` more times; the n'th retry waits a random
+    time of up to `backoff_base * 2**n` seconds, capped at `backoff_cap`, or
+    as long as a Retry-After header asks if that's longer. A request asked to
+    wait for more than `backoff_cap` fails instead."""
+
+    def __init__(
+        self,
+        token,
+        max_workers=4,
+        max_rate=5.0,
+        max_retries=5,
+        backoff_base=1.0,
+        backoff_cap=60.0,
+        timeout=60.0,
+    ):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.max_workers = max_workers
+        self.max_rate = max_rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = "Bearer " + token
+        self.session.mount(
+            "https://", HTTPAdapter(pool_maxsize=max(max_workers, 1))
+        )
+
+        self.latencies = []
+        self.n_retries = 0
+        self.rate_limits = {}  # path => (remaining requests, reset time)
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def _wait_for_turn(self):
+        if self.max_rate is None:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + 1.0 / self.max_rate
+
+        if start > now:
+            time.sleep(start - now)
+
+    def _note_rate_limit(self, path, headers):
+        try:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset = float(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+
+        with self._lock:
+            # ADS keeps a separate quota for each endpoint. Responses can
+            # arrive out of order, so within a quota period, the lowest count
+            # is the latest one.
+            prev = self.rate_limits.get(path)
+            if prev is None or reset != prev[1] or remaining < prev[0]:
+                self.rate_limits[path] = (remaining, reset)
+
+    def post(self, path, **kwargs):
+        """POST to the API endpoint `path` (relative to the API base URL),
+        retrying as needed, and return the decoded JSON response."""
+        import requests
+
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+
+        while True:
+            self._wait_for_turn()
+            t0 = time.monotonic()
+
+            try:
+                resp = self.session.post(API_BASE + path, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                resp = None
+                problem = str(e)
+            else:
+                if resp.status_code in RETRY_STATUSES:
+                    problem = "HTTP status %d" % resp.status_code
+                else:
+                    problem = None
+
+            with self._lock:
+                self.latencies.append(time.monotonic() - t0)
+
+            if resp is not None:
+                self._note_rate_limit(path, resp.headers)
+
+            if problem is None:
+                # Note: we can't pass `stream=True` to post() and then use
+                # `json.load(resp.raw)` here, because resp.raw is not decoded
+                # in any way — if the output is gzip-encoded, we get the gzip.
+                # Based on https://github.com/psf/requests/issues/465 , it
+                # looks lke this is just How It Is.
+                return json.loads(resp.text)
+
+            if attempt >= self.max_retries:
+                raise ADSCountError(
+                    "ADS request failed after %d attempts: %s",
+                    attempt + 1,
+                    problem,
+                )
+
+            delay = random.uniform(
+                0, min(self.backoff_cap, self.backoff_base * 2**attempt)
+            )
+
+            if resp is not None:
+                try:
+                    wait = float(resp.headers["Retry-After"])
+                except (KeyError, ValueError):
+                    pass
+                else:
+                    # ADS asks for hours when a daily quota runs out; rather
+                    # than silently sleeping that long, give up.
+                    if wait > self.backoff_cap:
+                        raise ADSCountError(
+                            "ADS asks us to wait %.0f s before retrying "
+                            "(quota exhausted?); giving up",
+                            wait,
+                        )
+                    delay = max(delay, wait)
+
+            with self._lock:
+                self.n_retries += 1
+
+            attempt += 1
+            time.sleep(delay)
+
+    def map(self, func, items):
+        """Return `[func(i) for i in items]`, computed using up to
+        `max_workers` threads."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        items = list(items)
+
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [func(i) for i in items]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(func, items))
+
+    def cite_count(self, bibcode):
+        """Return the total citation count of `bibcode`, via the metrics
+        API."""
+        structured = self.post(
+            "metrics", json={"bibcodes": [bibcode], "types": ["citations"]}
+        )
+
+        if "Error" in structured:
+            raise ADSCountError(
+                "%s", structured.get("Error Info", "unknown ADS API error")
+            )
+
+        # NB, the "citation stats refereed" structure is all zeros for items
+        # that are not themselves refereed.
+        d = structured.get("citation stats", {})
+
+        # count = d.get("total number of refereed citations")
+        count = d.get("total number of citations")
+
+        if count is None:
+            raise ADSCountError(
+                "ADS Metrics API response does not include expected "
+                "citation metric"
+            )
+
+        return count
+
+    def cite_count_batch(self, bibcodes):
+        """Return a dict mapping those of `bibcodes` that ADS knows to their
+        total citation counts, via a single search-API "bigquery". (The metrics
+        API also takes a list, but then aggregates the metrics over it.)"""
+        structured = self.post(
+            "search/bigquery",
+            params={
+                "q": "*:*",
+                "fl": "bibcode,citation_count",
+                "rows": len(bibcodes),
+            },
+            headers={"Content-Type": "big-query/csv"},
+            data="bibcode\n" + "\n".join(bibcodes),
+        )
+
+        if "error" in structured:
+            error = structured["error"]
+            if isinstance(error, dict):
+                error = error.get("msg", "unknown ADS API error")
+            raise ADSCountError("%s", error)
+
+        counts = {}
+
+        for doc in structured.get("response", {}).get("docs", ()):
+            count = doc.get("citation_count")
+            if count is not None:
+                counts[doc.get("bibcode")] = count
+
+        return counts
+
+    def cite_counts(
+        self, bibcodes, batch_size, cache=None, on_fetch=None, max_singles=None
+    ):
+        """Return a dict mapping each of `bibcodes` to its total citation count,
+        or to an ADSCountError if it couldn't be obtained. ADS is queried for
+        `batch_size` bibcodes at a time; bibcodes that a batch query doesn't
+        return (e.g., because ADS knows them under a different canonical
+        bibcode) are looked up individually, in the order of `bibcodes`, at
+        most `max_singles` of them if it isn't None, to spare the metrics
+        quota; the rest map to an ADSQuotaDeferral. If `cache` is an ADSCache,
+        new counts are saved to it as soon as they arrive. If `on_fetch` is
+        not None, it is also called (possibly from a worker thread) with a
+        dict of each set of new counts as they arrive."""
+
+        def fetched(found):
+            if cache is not None:
+                cache.store(found)
+            if on_fetch is not None and len(found):
+                on_fetch(found)
+
+        counts = {}
+        order = list(dict.fromkeys(bibcodes))
+        bibcodes = sorted(order)
+        batches = [
+            bibcodes[i : i + batch_size]
+            for i in range(0, len(bibcodes), batch_size)
+        ]
+
+        def query_batch(batch):
+            try:
+                found = self.cite_count_batch(batch)
+            except ADSCountError as e:
+                # If the whole query failed, individual ones would surely
+                # fail too, so don't spend the quota.
+                return dict((bibcode, e) for bibcode in batch)
+
+            found = dict((b, found[b]) for b in batch if b in found)
+            fetched(found)
+            return found
+
+        for found in self.map(query_batch, batches):
+            counts.update(found)
+
+        def query_one(bibcode):
+            try:
+                count = self.cite_count(bibcode)
+            except ADSCountError as e:
+                return e
+
+            fetched({bibcode: count})
+            return count
+
+        missing = [b for b in order if b not in counts]
+
+        if max_singles is not None and len(missing) > max_singles:
+            e = ADSQuotaDeferral("skipped to spare the ADS metrics quota")
+            counts.update((b, e) for b in missing[max_singles:])
+            missing = missing[:max_singles]
+
+        counts.update(zip(missing, self.map(query_one, missing)))
+        return counts
+
+    def latency_summary(self):
+        """Return a one-line description of the requests made so far."""
+        with self._lock:
+            lat = sorted(self.latencies)
+            n_retries = self.n_retries
+
+        if not len(lat):
+            return "no ADS requests made"
+
+        return (
+            "%d ADS request%s (%d retried); latency median %.0f ms, max %.0f ms"
+            % (
+                len(lat),
+                "" if len(lat) == 1 else "s",
+                n_retries,
+                1000 * lat[len(lat) // 2],
+                1000 * lat[-1],
+            )
+        )
+
+
+def default_cache_path():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "worklog-tools", "ads-cache.sqlite")
+
+
+class ADSCache(object):
+    """A persistent cache of citation counts, keyed by bibcode, in the SQLite
+    database at `path` (by default, see `default_cache_path`). At most
+    `max_entries` counts are kept. If the database can't be opened, the cache
+    is silently disabled: lookups find nothing and stores are ignored. The
+    same goes for errors (such as a lock held for too long by another
+    process) once it's open, since losing a cache entry costs only a
+    refetch."""
+
+    def __init__(self, path=None, max_entries=100000):
+        if path is None:
+            path = default_cache_path()
+
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = None
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS cite_counts ("
+                    "bibcode TEXT PRIMARY KEY, "
+                    "count INTEGER NOT NULL, "
+                    "fetched REAL NOT NULL)"
+                )
+                db.execute(
+                    "CREATE INDEX IF NOT EXISTS cite_counts_fetched "
+                    "ON cite_counts (fetched)"
+                )
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS meta ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+        except (OSError, sqlite3.Error):
+            return
+
+        self._db = db
+
+    def lookup(self, bibcodes, max_age=None):
+        """Return a dict mapping those of `bibcodes` with cached counts to
+        tuples `(count, fetched)`, where `fetched` is the Unix time at which
+        the count was fetched, ignoring counts fetched more than `max_age`
+        seconds ago if it isn't None."""
+
+        if self._db is None:
+            return {}
+
+        bibcodes = list(bibcodes)
+        oldest = None if max_age is None else time.time() - max_age
+        counts = {}
+
+        # SQLite limits the number of parameters in a statement.
+        chunk = 500
+
+        with self._lock:
+            try:
+                for i in range(0, len(bibcodes), chunk):
+                    some = bibcodes[i : i + chunk]
+                    rows = self._db.execute(
+                        "SELECT bibcode, count, fetched FROM cite_counts "
+                        "WHERE bibcode IN (%s)" % ",".join("?" * len(some)),
+                        some,
+                    )
+
+                    for bibcode, count, fetched in rows:
+                        if oldest is None or fetched >= oldest:
+                            counts[bibcode] = (count, fetched)
+            except sqlite3.Error:
+                pass
+
+        return counts
+
+    def store(self, counts):
+        """Save the counts in the dict `counts` as freshly fetched."""
+
+        if self._db is None or not len(counts):
+            return
+
+        now = time.time()
+
+        with self._lock:
+            try:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO cite_counts VALUES (?, ?, ?)",
+                        [(b, c, now) for b, c in counts.items()],
+                    )
+                    (n,) = self._db.execute(
+                        "SELECT COUNT(*) FROM cite_counts"
+                    ).fetchone()
+
+                    if n > self.max_entries:
+                        self._db.execute(
+                            "DELETE FROM cite_counts WHERE bibcode IN ("
+                            "SELECT bibcode FROM cite_counts "
+                            "ORDER BY fetched LIMIT ?)",
+                            (n - self.max_entries,),
+                        )
+            except sqlite3.Error:
+                pass
+
+    def rate_limit(self, path):
+        """Return the (remaining requests, reset time) of the ADS quota for
+        the API endpoint `path` as last seen by any process, or None if
+        unknown or since reset."""
+
+        if self._db is None:
+            return None
+
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    "SELECT value FROM meta WHERE key = ?",
+                    ("rate_limit " + path,),
+                ).fetchone()
+            except sqlite3.Error:
+                return None
+
+        if row is None:
+            return None
+
+        try:
+            remaining, reset = json.loads(row[0])
+        except ValueError:
+            return None
+
+        if reset <= time.time():
+            return None
+
+        return remaining, reset
+
+    def store_rate_limit(self, path, remaining, reset):
+        """Save the ADS quota state for the API endpoint `path` reported by
+        the latest response."""
+
+        if self._db is None:
+            return
+
+        with self._lock:
+            try:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                        (
+                            "rate_limit " + path,
+                            json.dumps([remaining, reset]),
+                        ),
+                    )
+            except sqlite3.Error:
+                pass
+
+
+class CiteJournal(object):
+    """An append-only journal of fetched citation counts, in the text file at
+    `path`, one "BIBCODE COUNT TIME" line per count. Each batch of counts is
+    flushed to disk as it's appended, and a line cut short by a crash is
+    ignored when the journal is read back. If the file can't be written, the
+    journal is silently disabled, as with `ADSCache`."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._broken = False
+
+    def load(self, max_age=None):
+        """Return a dict mapping bibcodes to tuples `(count, fetched)` of their
+        journaled counts and the Unix times at which they were fetched,
+        ignoring counts fetched more than `max_age` seconds ago if it isn't
+        None. Later lines override earlier ones."""
+
+        oldest = None if max_age is None else time.time() - max_age
+        counts = {}
+
+        try:
+            with io.open(self.path, "rt") as f:
+                for line in f:
+                    pieces = line.split()
+                    if len(pieces) != 3 or not line.endswith("\n"):
+                        continue
+
+                    try:
+                        count = int(pieces[1])
+                        fetched = float(pieces[2])
+                    except ValueError:
+                        continue
+
+                    if oldest is None or fetched >= oldest:
+                        counts[pieces[0]] = (count, fetched)
+        except (IOError, OSError):
+            pass
+
+        return counts
+
+    def append(self, counts):
+        """Durably record the counts in the dict `counts`."""
+
+        now = time.time()
+        text = "".join(
+            "%s %d %.0f\n" % (b, c, now) for b, c in sorted(counts.items())
+        )
+
+        with self._lock:
+            if self._broken:
+                return
+
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with io.open(self.path, "at") as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except (IOError, OSError):
+                self._broken = True
+
+    def remove(self):
+        """Delete the journal, once its counts are safely elsewhere."""
+
+        with self._lock:
+            try:
+                os.unlink(self.path)
+            except (IOError, OSError):
+                pass
@@ -0,0 +1,480 @@
+# -*- mode: python; coding: utf-8 -*-
+# Licensed under the GNU General Public License, version 3 or higher.
+
+"""A persistent cache of parsed worklog data files.
+
+Every wltool invocation used to re-parse every data file, and a typical
+Makefile runs the tool several times per build. Instead, we keep a sidecar
+directory (`.wlcache` in the data directory) holding a pickle of the records
+parsed from each data file. An entry is reused as-is if the file's size and
+modification time are unchanged; if they have changed but the content hash
+hasn't (e.g., after a `touch`), the entry is revalidated and reused as well.
+Otherwise the file has changed, but usually only a little: each entry also
+records the byte range and content hash of every record in the file (see
+`inifile.recordOffsets`), so we only re-parse the records whose bytes aren't
+already known, and reuse the cached results for the rest. The parsing that
+does need doing can optionally be farmed out to a pool of worker processes.
+
+The cache directory also holds a small manifest recording, for each data
+file, the range of dates of the records in each of its sections (as computed
+by `worklog.load`). This lets `worklog.list_data_files` avoid opening files
+that can't contain any records in a given time window.
+
+Finally, it holds an index listing the byte range, section name, and content
+hash of every record of every data file, again keyed by each file's size and
+modification time. Loading the index is much cheaper than loading the parsed
+records, so it lets us answer questions like "how many records are there in
+each section?" by just checking that the data files haven't changed, without
+parsing them, and lets us read and parse just the records of interest when
+there's no cached copy of them.
+
+The cache directory is capped in size; when it grows past the cap, the
+least-recently-used entries are evicted. If the cache directory can't be
+created (say, the data directory is read-only), we silently fall back to
+parsing everything.
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import io
+import os
+import pickle
+
+__all__ = ["CACHE_DIRNAME", "DEFAULT_MAX_BYTES", "ParseCache", "read_manifest"]
+
+CACHE_DIRNAME = ".wlcache"
+MANIFEST_NAME = "manifest.dat"  # not ".pickle", so never evicted
+INDEX_NAME = "index.dat"  # ditto
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Bump this whenever the pickled representation of entries or records changes.
+CACHE_VERSION = 5
+
+
+def parse_bytes(raw, sections=None):
+    """Parse the raw contents of a data file into a list of records, decoding
+    them exactly as `io.open(path, 'rt')` would. If `sections` is not None,
+    only records in those sections are parsed."""
+    from inifile import readStream
+
+    return list(readStream(io.TextIOWrapper(io.BytesIO(raw)), sections))
+
+
+# Each chunk of a cache entry describes one independently-parseable byte range
+# of the data file; see `inifile.recordOffsets`. Chunks are lists
+# [offset, length, sha1, section, records], where `records` is None if the
+# range hasn't been parsed yet.
+_OFS, _LEN, _DIGEST, _SECT, _RECS = range(5)
+
+
+def _wanted(section, sections):
+    # The leading range (section None) is always parsed so that any errors in
+    # it are reported no matter which sections were asked for.
+    return section is None or sections is None or section in sections
+
+
+def _read_versioned(path):
+    try:
+        with io.open(path, "rb") as f:
+            item = pickle.load(f)
+    except Exception:
+        # Missing, truncated, or written by an incompatible version.
+        return None
+
+    if not isinstance(item, dict) or item.get("version") != CACHE_VERSION:
+        return None
+    return item
+
+
+def read_manifest(datadir):
+    """Return the date-span manifest of the data files in `datadir`: a dict
+    mapping file basenames to tuples `(size, mtime_ns, known, spans)`. `known`
+    is the set of sections whose records have been examined, or None if all
+    have been, and `spans` maps each of those sections that has any records to
+    the inclusive `((year, month), (year, month))` range of their dates, or to
+    None if some of them are undated. Entries are only valid if the size and
+    mtime of the file still match. If there is no usable manifest, the result
+    is empty."""
+
+    manifest = _read_versioned(
+        os.path.join(datadir, CACHE_DIRNAME, MANIFEST_NAME)
+    )
+    if manifest is None:
+        return {}
+    return manifest["files"]
+
+
+class ParseCache(object):
+    """If `persist` is false, nothing is read from or written to disk; the
+    object then just provides the (possibly parallel) parsing machinery."""
+
+    def __init__(self, datadir, max_bytes=DEFAULT_MAX_BYTES, persist=True):
+        self.datadir = datadir
+        self.dir = os.path.join(datadir, CACHE_DIRNAME)
+        self.max_bytes = max_bytes
+        self.n_hits = 0
+        self.n_misses = 0
+        self.stats = {}
+        self._index = None
+        self._index_dirty = False
+        self._wrote = False
+        self.enabled = False
+
+        if persist:
+            try:
+                os.makedirs(self.dir)
+            except OSError:
+                pass
+
+            self.enabled = os.path.isdir(self.dir) and os.access(
+                self.dir, os.W_OK
+            )
+
+    def _entry_path(self, path):
+        key = os.path.abspath(path).encode("utf-8")
+        return os.path.join(
+            self.dir, hashlib.sha1(key).hexdigest() + ".pickle"
+        )
+
+    def _read_entry(self, epath):
+        return _read_versioned(epath)
+
+    def _load_index(self):
+        if self._index is None:
+            index = None
+            if self.enabled:
+                index = _read_versioned(os.path.join(self.dir, INDEX_NAME))
+            self._index = {} if index is None else index["files"]
+        return self._index
+
+    def _index_lookup(self, path, st):
+        """Return the index entry of `path` if it's up to date, else None.
+        Entries are tuples `(size, mtime_ns, digest, ranges)`, where `ranges`
+        lists the `(offset, length, sha1, section)` of each chunk."""
+
+        ientry = self._load_index().get(os.path.basename(path))
+        if ientry is None or ientry[:2] != (st.st_size, st.st_mtime_ns):
+            return None
+        return ientry
+
+    def _index_update(self, state):
+        key = os.path.basename(state.path)
+        ientry = (
+            state.st.st_size,
+            state.st.st_mtime_ns,
+            state.digest,
+            tuple(tuple(c[:_RECS]) for c in state.chunks),
+        )
+
+        if self._load_index().get(key) != ientry:
+            self._index[key] = ientry
+            self._index_dirty = True
+
+    def _save_index(self):
+        if not self._index_dirty:
+            return
+
+        self._write_entry(
+            os.path.join(self.dir, INDEX_NAME),
+            dict(version=CACHE_VERSION, files=self._index),
+        )
+        self._index_dirty = False
+
+    def _write_entry(self, epath, entry):
+        tmppath = "%s.%d.tmp" % (epath, os.getpid())
+
+        try:
+            with io.open(tmppath, "wb") as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmppath, epath)
+        except Exception:
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+            return
+
+        self._wrote = True
+
+    def _touch(self, epath):
+        # Entry mtimes double as LRU timestamps.
+        try:
+            os.utime(epath, None)
+        except OSError:
+            pass
+
+    def _check(self, path, sections, headers_only):
+        """Look up `path`, returning a Holder describing the state of its
+        entry. Its `chunks` are the entry's chunks, some of which may still
+        need to be parsed from `raw`; `dirty` says whether the entry will need
+        to be rewritten afterwards."""
+
+        from inifile import Holder, recordOffsets
+
+        state = Holder(path=path, raw=None, pieces=None, dirty=False)
+        state.whole = False
+        state.epath = entry = None
+
+        with io.open(path, "rb") as f:
+            state.st = self.stats[path] = os.fstat(f.fileno())
+
+            if self.enabled:
+                state.epath = self._entry_path(path)
+                ientry = self._index_lookup(path, state.st)
+
+                if ientry is not None and headers_only:
+                    # The index tells us everything that we need to know.
+                    self.n_hits += 1
+                    state.digest = ientry[2]
+                    state.chunks = [list(r) + [None] for r in ientry[3]]
+                    return state
+
+                entry = self._read_entry(state.epath)
+
+                if (
+                    entry is None
+                    and ientry is not None
+                    and sections is not None
+                ):
+                    # No parsed copy, but the index tells us where the records
+                    # that we want are, so we can read just those.
+                    self.n_misses += 1
+                    state.digest = ientry[2]
+                    state.chunks = [list(r) + [None] for r in ientry[3]]
+                    state.pieces = {}
+
+                    for c in state.chunks:
+                        if _wanted(c[_SECT], sections):
+                            f.seek(c[_OFS])
+                            state.pieces[c[_OFS]] = f.read(c[_LEN])
+                    return state
+
+            if (
+                entry is not None
+                and entry["size"] == state.st.st_size
+                and entry["mtime_ns"] == state.st.st_mtime_ns
+            ):
+                self.n_hits += 1
+                self._touch(state.epath)
+                state.digest = entry["digest"]
+                state.chunks = [list(c) for c in entry["chunks"]]
+
+                if not headers_only and any(
+                    c[_RECS] is None and _wanted(c[_SECT], sections)
+                    for c in state.chunks
+                ):
+                    # Records that we skipped last time are needed now.
+                    state.raw = f.read()
+                return state
+
+            state.raw = f.read()
+
+        if not self.enabled:
+            self.n_misses += 1
+            state.digest = None
+
+            if headers_only:
+                state.chunks = [
+                    [ofs, length, None, sect, None]
+                    for ofs, length, sect in recordOffsets(state.raw)
+                ]
+            else:
+                # No point in splitting up the file; let the scanner skip
+                # over unwanted records.
+                state.whole = True
+                state.chunks = [[0, len(state.raw), None, None, None]]
+            return state
+
+        state.dirty = True
+        state.digest = hashlib.sha1(state.raw).hexdigest()
+
+        if entry is not None and entry["digest"] == state.digest:
+            self.n_hits += 1
+            state.chunks = [list(c) for c in entry["chunks"]]
+            return state
+
+        # The file has changed. Re-parse only the records whose bytes differ
+        # from those of a record we already know about. Each old record is
+        # reused at most once so that duplicated records don't end up as
+        # aliases of the same object.
+
+        reusable = {}
+
+        if entry is not None:
+            for c in entry["chunks"]:
+                reusable.setdefault(c[_DIGEST], []).append(c[_RECS])
+
+        self.n_misses += 1
+        state.chunks = []
+
+        for ofs, length, sect in recordOffsets(state.raw):
+            cdigest = hashlib.sha1(state.raw[ofs : ofs + length]).hexdigest()
+            prev = reusable.get(cdigest)
+            records = prev.pop() if prev else None
+            state.chunks.append([ofs, length, cdigest, sect, records])
+
+        return state
+
+    def _fill(self, state):
+        if not self.enabled:
+            return
+
+        self._write_entry(
+            state.epath,
+            dict(
+                version=CACHE_VERSION,
+                path=state.path,
+                size=state.st.st_size,
+                mtime_ns=state.st.st_mtime_ns,
+                digest=state.digest,
+                chunks=[tuple(c) for c in state.chunks],
+            ),
+        )
+
+    def load(self, path, **kwargs):
+        """Return the list of records in the data file `path`, using and
+        updating the cache as appropriate. Keywords are as for
+        `load_many`."""
+
+        return self.load_many([path], **kwargs)[0]
+
+    def load_many(self, paths, jobs=1, sections=None, headers_only=False):
+        """Return a list of the record lists of each of the data files in
+        `paths`, in order.
+
+        If `jobs` is greater than one, the byte ranges needing parsing are
+        spread over a pool of that many worker processes. If `sections` is
+        not None, only records in those sections are returned, and others
+        aren't parsed at all if they don't have to be. If `headers_only` is
+        true, nothing is parsed: the returned records are stubs containing
+        only their `section` fields."""
+
+        from inifile import Record
+
+        states = []
+        tasks = []
+
+        for path in paths:
+            state = self._check(path, sections, headers_only)
+            states.append(state)
+
+            if headers_only:
+                continue
+
+            for c in state.chunks:
+                if c[_RECS] is None and _wanted(c[_SECT], sections):
+                    if state.raw is None:
+                        data = state.pieces[c[_OFS]]
+                    else:
+                        data = state.raw[c[_OFS] : c[_OFS] + c[_LEN]]
+                    tasks.append((c, data, sections if state.whole else None))
+
+                    if not state.whole:
+                        state.dirty = True
+
+        if jobs > 1 and len(tasks) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+
+            chunksize = max(1, len(tasks) // (4 * jobs))
+
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                parsed = list(
+                    pool.map(
+                        parse_bytes,
+                        [t[1] for t in tasks],
+                        [t[2] for t in tasks],
+                        chunksize=chunksize,
+                    )
+                )
+        else:
+            parsed = [parse_bytes(t[1], t[2]) for t in tasks]
+
+        for (c, _, _), records in zip(tasks, parsed):
+            c[_RECS] = records
+
+        results = []
+
+        for state in states:
+            if state.dirty:
+                self._fill(state)
+            if self.enabled:
+                self._index_update(state)
+
+            if headers_only:
+                results.append(
+                    [
+                        Record(section=c[_SECT])
+                        for c in state.chunks
+                        if c[_SECT] is not None
+                    ]
+                )
+            else:
+                results.append(
+                    [
+                        rec
+                        for c in state.chunks
+                        if _wanted(c[_SECT], sections)
+                        for rec in c[_RECS]
+                    ]
+                )
+
+        self._save_index()
+        return results
+
+    def update_manifest(self, updates, manifest=None):
+        """Merge `updates`, a dict of entries as described in `read_manifest`,
+        into the manifest. If the caller has already read the manifest, it
+        can pass it as `manifest` to spare us reading it again."""
+
+        if not self.enabled or not len(updates):
+            return
+
+        if manifest is None:
+            files = read_manifest(self.datadir)
+        else:
+            files = dict(manifest)
+
+        files.update(updates)
+        self._write_entry(
+            os.path.join(self.dir, MANIFEST_NAME),
+            dict(version=CACHE_VERSION, files=files),
+        )
+
+    def evict(self):
+        """Trim the cache directory to `max_bytes`, dropping the
+        least-recently-used entries first. Only does any work if we've
+        written something since the last call."""
+
+        if not self.enabled or not self._wrote:
+            return
+        self._wrote = False
+
+        entries = []
+        total = 0
+
+        for name in os.listdir(self.dir):
+            if not name.endswith(".pickle"):
+                continue
+
+            epath = os.path.join(self.dir, name)
+            try:
+                st = os.stat(epath)
+            except OSError:
+                continue
+
+            entries.append((st.st_mtime, st.st_size, epath))
+            total += st.st_size
+
+        entries.sort()
+
+        for _, size, epath in entries:
+            if total <= self.max_bytes:
+                break
+
+            try:
+                os.unlink(epath)
+            except OSError:
+                continue
+            total -= size
@@ -12,12 +12,15 @@ Shared routines for my worklog tools.
 from __future__ import absolute_import, division, print_function
 from six import string_types, text_type
 from six.moves import map, range
+from functools import lru_cache
 
 # Infrastructure
 
 from inifile import Holder
 
 from unicode_to_latex import unicode_to_latex_string
+from wlads import ADSCountError
+
 # , latex_to_unicode_string
 
 try:
@@ -49,6 +52,7 @@ open_template
 slurp_template
 process_template
 list_data_files
+RecordFilter
 load
 unicode_to_latex_string
 html_escape
@@ -64,7 +68,15 @@ render_latex
 render_html
 render_markdown
 Formatter
+get_formatter
 ADSCountError
+ADS_BATCH_SIZE
+ADS_CACHE_TTL
+get_ads_cache
+get_ads_cached_counts
+get_ads_cite_counts
+get_ads_client
+get_ads_rate_limit
 parse_ads_cites
 canonicalize_name
 surname
@@ -125,13 +137,7 @@ def slurp_template(stem):
 
 
 def _get_studentfirstauth(pub):
-    advposlist = pub.get("advpos", "")
-    studentfirstauth = False
-    if len(advposlist):
-        for i in [int(x) - 1 for x in advposlist.split(",")]:
-            if i == 0:
-                studentfirstauth = True
-    return studentfirstauth
+    return 0 in typed(pub, "advpos", ())
 
 
 def _quant_to_num_prettify(quantity, units):
@@ -235,12 +241,65 @@ def process_template(stream, commands, context):
                         yield subline
 
 
-def list_data_files(datadir="."):
-    from os import listdir
+def _filename_span(name):
+    # By convention, data files are named by year: "2015.txt", "2013p.txt".
+    year = name[:4]
+    if len(year) != 4 or not year.isdigit():
+        return None
+    year = int(year)
+    return (year, 1), (year, 12)
+
+
+def _may_match(entry, predicate):
+    """Decide whether a data file described by a manifest `entry` (see
+    `wlcache.read_manifest`) may contain records accepted by `predicate`."""
+
+    known, spans = entry[2:]
+    sections = predicate.sections
+
+    if sections is None:
+        if known is not None:
+            return True
+        sections = spans.keys()
+
+    for section in sections:
+        if known is not None and section not in known:
+            return True  # never looked
+        if section not in spans:
+            continue  # no records in this section
+
+        span = spans[section]
+        if span is None or predicate.overlaps(span):
+            return True
+
+    return False
+
+
+def list_data_files(
+    datadir=".", predicate=None, trust_filenames=False, manifest=None
+):
+    """Yield the paths of the data files in `datadir`.
+
+    If `predicate` is a `RecordFilter` with a date window, files that can't
+    contain any records that it accepts are skipped. That's decided using the
+    manifest in the parse cache directory (see `wlcache`), if it has an
+    up-to-date entry for the file; pass `manifest` if it has already been
+    read. If `trust_filenames` is true, a file without one whose name starts
+    with a year ("2015.txt", "2013p.txt") is assumed to hold only records
+    dated in that year. Anything else is always yielded."""
+
+    from os import listdir, stat
     from os.path import join
 
     any = False
 
+    if predicate is None or not predicate.has_window():
+        manifest = None
+    elif manifest is None:
+        from wlcache import read_manifest
+
+        manifest = read_manifest(datadir)
+
     for item in sorted(listdir(datadir)):
         if item.startswith("."):
             continue
@@ -250,19 +309,359 @@ def list_data_files(datadir="."):
         # Note that if there are text files that contain no records (e.g. all
         # commented), we won't complain.
         any = True
-        yield join(datadir, item)
+        path = join(datadir, item)
+
+        if manifest is not None:
+            entry = manifest.get(item)
+
+            if entry is not None:
+                try:
+                    st = stat(path)
+                except OSError:
+                    entry = None
+                else:
+                    if entry[:2] != (st.st_size, st.st_mtime_ns):
+                        entry = None
+
+            if entry is not None:
+                if not _may_match(entry, predicate):
+                    continue
+            elif trust_filenames:
+                span = _filename_span(item)
+                if span is not None and not predicate.overlaps(span):
+                    continue
+
+        yield path
 
     if not any:
         die('no data files found in directory "%s"', datadir)
 
 
-def load(datadir="."):
-    from inifile import read as iniread
+def _parse_year_month(text, default_month):
+    bits = text.replace("/", " ").split()
+
+    if not len(bits) or len(bits[0]) != 4:
+        return None
+
+    try:
+        year = int(bits[0])
+    except ValueError:
+        return None
+
+    if len(bits) < 2:
+        return year, default_month
+
+    month = bits[1][:3].title()
+    if month in months:
+        return year, months.index(month) + 1
+
+    try:
+        return year, int(bits[1])
+    except ValueError:
+        return year, default_month
+
+
+def record_date_span(item):
+    """Return the inclusive range of (year, month) tuples covered by the
+    `pubdate` or `date` field of `item`, or None if it hasn't got one that we
+    understand. Both "2013/12/31" and "2013 Dec" styles are accepted, as are
+    ranges like "2013-2015" and open-ended ones like "2022-present"."""
+
+    text = item.get("pubdate")
+    if text is None:
+        text = item.get("date")
+    if text is None:
+        return None
+
+    first, dash, last = text.strip().partition("-")
+    start = _parse_year_month(first, 1)
+    if start is None:
+        return None
+
+    if not dash:
+        end = _parse_year_month(first, 12)
+    elif last.strip() in ("", "present"):
+        end = (9999, 12)
+    else:
+        end = _parse_year_month(last, 12)
+        if end is None:
+            return None
+
+    return start, end
+
+
+class RecordFilter(object):
+    """A predicate choosing which records `load` should yield.
+
+    If `sections` is not None, only records in those sections are wanted, and
+    the others aren't parsed at all. `since` and `until` are optional
+    inclusive (year, month) bounds; records whose date span (see
+    `record_date_span`) falls entirely outside of them are dropped, while
+    records without an understandable date are kept. If `headers_only` is
+    true, the records yielded contain nothing but their `section` field, which
+    is all that some tools need.
+
+    """
+
+    def __init__(
+        self, sections=None, since=None, until=None, headers_only=False
+    ):
+        if sections is not None:
+            sections = frozenset(sections)
+
+        self.sections = sections
+        self.since = since
+        self.until = until
+        self.headers_only = headers_only
+
+    def has_window(self):
+        return self.since is not None or self.until is not None
+
+    def overlaps(self, span):
+        """Decide whether the inclusive ((year, month), (year, month)) range
+        `span` overlaps with our date window."""
+
+        if self.since is not None and span[1] < tuple(self.since):
+            return False
+        if self.until is not None and span[0] > tuple(self.until):
+            return False
+        return True
+
+    def __call__(self, item):
+        if self.sections is not None and item.section not in self.sections:
+            return False
+
+        if not self.has_window():
+            return True
+
+        span = record_date_span(item)
+        return span is None or self.overlaps(span)
+
+
+def _section_spans(records):
+    spans = {}
+
+    for item in records:
+        span = record_date_span(item)
+        prev = spans.get(item.section, ())
+
+        if prev is None or span is None:
+            spans[item.section] = None
+        elif prev == ():
+            spans[item.section] = span
+        else:
+            spans[item.section] = (
+                min(prev[0], span[0]),
+                max(prev[1], span[1]),
+            )
+
+    return spans
+
+
+# Typed fields. Rendering would otherwise convert the same strings over and
+# over (e.g. `int(pub.mypos)` several times per publication), so the fields
+# listed in `field_schema` are decoded once, at load time, and the results are
+# stored alongside the original strings in fields whose names have a leading
+# underscore (e.g. `_mypos`). Templates can still use the originals, and
+# `inifile.write` ignores the decoded versions. Use `typed` to get at them.
+
+
+def _decode_poslist(text):
+    # 1-based author positions -> tuple of 0-based indices
+    if not len(text):
+        return ()
+    return tuple(int(x) - 1 for x in text.split(","))
+
+
+def _decode_ints(text):
+    return tuple(int(x) for x in text.split("/"))
+
+
+def _decode_flag(text):
+    return text == "y"
+
+
+def _decode_amount(text):
+    quantity, units = text.split()
+    return float(quantity), units
+
+
+def _decode_adscites(text):
+    from time import mktime
+
+    a = text.split()[:2]
+    y, m, d = [int(x) for x in a[0].split("/")]
+    return int(mktime((y, m, d, 0, 0, 0, 0, 0, 0))), int(a[1])
+
+
+field_schema = {
+    "pub": {
+        "mypos": int,
+        "advpos": _decode_poslist,
+        "pubdate": _decode_ints,  # (year, month)
+        "adscites": _decode_adscites,  # (lastupdate, cites)
+        "refereed": _decode_flag,
+    },
+    "prop": {
+        "mepi": _decode_flag,
+        "accepted": _decode_flag,
+        "award": _decode_amount,  # (quantity, units)
+        "request": _decode_amount,
+    },
+    "repo": {
+        "usercommits": int,
+        "allcommits": int,
+        "stars": int,
+        "forks": int,
+        "lastusercommit": _decode_ints,  # (year, month, day)
+        "skip": _decode_flag,
+    },
+    "obs": {
+        "time": _decode_amount,
+    },
+    "talk": {
+        "invited": _decode_flag,
+        "conference": _decode_flag,
+    },
+}
+
+_no_default = object()
+
+
+def decode_fields(item, schema=field_schema):
+    """Decode the fields of `item` listed in `schema` for its section, storing
+    the results in underscore-prefixed fields. Values that can't be decoded
+    are left alone, so that `typed` reports the problem if and when the value
+    is actually needed."""
 
-    for path in list_data_files(datadir):
-        for item in iniread(path):
+    decoded = {}
+
+    for name, decoder in schema.get(item.section, {}).items():
+        value = item.get(name)
+        if value is None:
+            continue
+
+        try:
+            decoded["_" + name] = decoder(value)
+        except Exception:
+            pass
+
+    # One set() call lets a Record adopt a single new layout for them all.
+    return item.set(**decoded)
+
+
+def typed(item, name, default=_no_default):
+    """Return the decoded value of the field `name` of `item`, per
+    `field_schema`. If the field is missing, return `default` if given;
+    otherwise the field is fetched (and decoded) the hard way, raising the
+    same exceptions that the naive code would."""
+
+    value = item.get("_" + name, _no_default)
+    if value is not _no_default:
+        return value
+
+    if default is not _no_default and not item.has(name):
+        return default
+
+    return field_schema[item.section][name](getattr(item, name))
+
+
+def load(
+    datadir=".",
+    cache=True,
+    jobs=1,
+    predicate=None,
+    trust_filenames=False,
+    schema=field_schema,
+):
+    """Yield every record in the data files of `datadir`. If `cache` is true,
+    parsed records are kept in a sidecar cache directory (see `wlcache`) so
+    that unchanged files needn't be re-parsed on the next run. If `jobs` is
+    greater than one, files needing parsing are spread over that many worker
+    processes; either way, records come out in the usual order. If
+    `predicate` is a `RecordFilter`, only the records that it accepts are
+    yielded, records in unwanted sections are skipped without being parsed,
+    and files that can't contain records in its date window aren't opened (see
+    `list_data_files` for the meaning of `trust_filenames`). Fields listed in
+    `schema` are decoded as the records are loaded (see `decode_fields`); pass
+    None to skip that."""
+    from os.path import basename
+    from wlcache import ParseCache, read_manifest
+
+    pcache = ParseCache(datadir, persist=cache)
+    kwargs = {}
+    known = None
+
+    if predicate is not None:
+        kwargs["sections"] = known = predicate.sections
+        kwargs["headers_only"] = predicate.headers_only
+
+    # Stub records have no dates, so we can't learn anything from them for the
+    # manifest used by `list_data_files`.
+    learn = pcache.enabled and not kwargs.get("headers_only")
+    manifest = None
+
+    if learn or (predicate is not None and predicate.has_window()):
+        manifest = read_manifest(datadir)
+
+    paths = list(
+        list_data_files(
+            datadir,
+            predicate=predicate,
+            trust_filenames=trust_filenames,
+            manifest=manifest,
+        )
+    )
+    results = pcache.load_many(paths, jobs=jobs, **kwargs)
+
+    # Keep the manifest up to date.
+
+    if learn:
+        updates = {}
+
+        for path, records in zip(paths, results):
+            st = pcache.stats[path]
+            name = basename(path)
+            entry = manifest.get(name)
+
+            if entry is not None and entry[:2] == (st.st_size, st.st_mtime_ns):
+                if entry[2] is None or (
+                    known is not None and known <= entry[2]
+                ):
+                    continue  # nothing new to learn
+
+                # Merge what we knew with what we're about to find out.
+                if known is None:
+                    spans = _section_spans(records)
+                    updates[name] = entry[:2] + (None, spans)
+                else:
+                    spans = dict(entry[3])
+                    spans.update(_section_spans(records))
+                    updates[name] = entry[:2] + (entry[2] | known, spans)
+                continue
+
+            updates[name] = (
+                st.st_size,
+                st.st_mtime_ns,
+                known,
+                _section_spans(records),
+            )
+
+        pcache.update_manifest(updates, manifest)
+
+    if kwargs.get("headers_only"):
+        schema = None  # stubs have nothing to decode
+
+    for records in results:
+        for item in records:
+            if predicate is not None and not predicate(item):
+                continue
+            if schema is not None:
+                decode_fields(item, schema)
             yield item
 
+    pcache.evict()
+
 
 # Text formatting. We have a tiny DOM-type system for markup so we can
 # abstract across LaTeX and HTML. Initially I tried to do everything in HTML,
@@ -271,37 +670,201 @@ def load(datadir="."):
 # tables). So we do this silliness instead.
 
 
+_html_escapes = (
+    ("&", "&amp;"),
+    ("<", "&lt;"),
+    (">", "&gt;"),
+    ('"', "&quot;"),
+    ("'", "&apos;"),
+)
+
+
 def html_escape(text):
     """Escape special characters for our dumb subset of HTML."""
 
-    return (
-        text_type(text)
-        .replace("&", "&amp;")
-        .replace("<", "&lt;")
-        .replace(">", "&gt;")
-        .replace('"', "&quot;")
-        .replace("'", "&apos;")
+    text = text_type(text)
+    for old, new in _html_escapes:
+        text = text.replace(old, new)
+    return text
+
+
+# Rewriting of plain text for each output format: escaping, then the
+# replacements listed in the relevant `custom_markdowns` dictionary (applied
+# in order, each to the output of the previous ones), then conversion of
+# "_{...}" subscripts. All of this is compiled once per format into a single
+# function; see `text_rewriter`.
+
+
+def _latex_subscript(m):
+    # Everything after the first "\}" goes through with any further "\}"
+    # unescaped, for compatibility with the original split-based code.
+    subs, sep, rest = m.group(1).partition("\\}")
+    return r"\ensuremath{_{\mathrm{" + subs + r"}}}" + rest.replace("\\}", "}")
+
+
+def _html_subscript(m):
+    subs, sep, rest = m.group(1).partition("}")
+    return "<sub>" + subs + "</sub>" + rest
+
+
+def _text_rules(fmt):
+    if fmt == "latex":
+        return custom_latex_md_dict, "\\_\\{", _latex_subscript
+    if fmt == "html":
+        return custom_html_md_dict, "_{", _html_subscript
+    if fmt == "markdown":
+        return custom_markdown_md_dict, "_{", _html_subscript
+    raise ValueError("unknown output format %r" % (fmt,))
+
+
+def _compile_text_rewriter(fmt, custom):
+    import re
+
+    marker, subscript = _text_rules(fmt)[1:]
+
+    # A subscript runs from its marker to the next one or the end of the text.
+    regex = re.compile(
+        re.escape(marker) + "((?:(?!" + re.escape(marker) + ").)*)", re.S
     )
+    subscripts = regex.sub
+
+    # Replacing each pattern in turn, skipping those that don't occur, beats
+    # merging the patterns into one big regex: we've got a couple dozen rules
+    # at most, and CPython scans for each literal much faster than it can
+    # scan for an alternation.
+
+    if fmt == "latex":
+        prepare = unicode_to_latex_string
+        rules = custom
+    else:
+        prepare = text_type
+        rules = _html_escapes + custom
+
+    # The same strings come up over and over again (coauthor names, journal
+    # names, separators, ...), so memoize. A fresh cache comes with each
+    # compilation, so changes to the rules invalidate it.
+
+    @lru_cache(maxsize=TEXT_CACHE_SIZE)
+    def rewrite(text):
+        text = prepare(text)
+
+        for old, new in rules:
+            if old in text:
+                text = text.replace(old, new)
+
+        if marker in text:
+            text = subscripts(subscript, text)
+
+        return text
+
+    return rewrite
+
+
+_text_rewriters = {}
+
+# The number of rendered strings memoized for each format.
+TEXT_CACHE_SIZE = 4096
+
+
+def text_rewriter(fmt):
+    """Return a function that converts plain text into `fmt`, which is
+    "latex", "html", or "markdown". The function is compiled on first use and
+    recompiled if the relevant `custom_markdowns` dictionary has changed
+    since. While a `Markup` tree is being rendered, that's checked once per
+    format (see `_rewrite_text`), so that the check isn't repeated for every
+    little piece of text."""
+
+    custom = _text_rules(fmt)[0]
+
+    if custom is None:
+        custom = ()
+    else:
+        custom = tuple((k, text_type(v)) for k, v in custom.items())
+
+    cached = _text_rewriters.get(fmt)
+    if cached is not None and cached[0] == custom:
+        return cached[1]
+
+    rewrite = _compile_text_rewriter(fmt, custom)
+    _text_rewriters[fmt] = (custom, rewrite)
+    return rewrite
+
+
+def text_cache_info():
+    """Return a dict mapping each output format used so far to the hit/miss
+    statistics of its memo of rendered strings, as reported by
+    `functools.lru_cache`. The entries "render_latex", "render_html", and
+    "render_markdown" cover plain strings passed to those functions."""
+
+    info = dict((fmt, c[1].cache_info()) for fmt, c in _text_rewriters.items())
+    info["render_latex"] = _render_latex_text.cache_info()
+    info["render_html"] = _render_html_text.cache_info()
+    info["render_markdown"] = _render_markdown_text.cache_info()
+    return info
+
+
+# The formats whose rewriters have been checked for staleness during the
+# current top-level `Markup` rendering, or None outside of one.
+_checked_formats = None
+
+
+def _rewrite_text(fmt, text):
+    checked = _checked_formats
+
+    if checked is None or fmt not in checked:
+        # Nodes can render their children in other formats (e.g., Markdown
+        # embeds HTML), so this is checked for each format as it comes up.
+        rewrite = text_rewriter(fmt)
+        if checked is not None:
+            checked.add(fmt)
+        return rewrite(text)
+
+    return _text_rewriters[fmt][1](text)
 
 
 class Markup(object):
-    def _latex(self):
+    """Markup is rendered by walking the tree once, with each node calling
+    `write` on the fragments of its rendering into `fmt` ("latex", "html", or
+    "markdown"), recursing into its children as it goes. Subclasses implement
+    `_write`."""
+
+    def _write(self, fmt, write):
         raise NotImplementedError()
 
+    def _render(self, fmt):
+        global _checked_formats
+
+        if _checked_formats is not None:
+            return "".join(self._fragments(fmt))
+
+        _checked_formats = set()
+        try:
+            return "".join(self._fragments(fmt))
+        finally:
+            _checked_formats = None
+
+    def _fragments(self, fmt):
+        result = []
+        self._write(fmt, result.append)
+        return result
+
+    def _latex(self):
+        return self._fragments("latex")
+
     def _html(self):
-        raise NotImplementedError()
+        return self._fragments("html")
 
     def _markdown(self):
-        raise NotImplementedError()
+        return self._fragments("markdown")
 
     def latex(self):
-        return "".join(self._latex())
+        return self._render("latex")
 
     def html(self):
-        return "".join(self._html())
+        return self._render("html")
 
     def markdown(self):
-        return "".join(self._markdown())
+        return self._render("markdown")
 
 
 def _maybe_wrap_text(thing):
@@ -314,284 +877,118 @@ class MupText(Markup):
     def __init__(self, text):
         self.text = text_type(text)
 
-    # def _latex(self):
-    #     return [unicode_to_latex_string(self.text)]
+    def _write(self, fmt, write):
+        write(_rewrite_text(fmt, self.text))
 
-    def _latex(self):
-        arr = [unicode_to_latex_string(self.text)]
-        for i, t in enumerate(arr):
-            if custom_latex_md_dict is not None:
-                for key in custom_latex_md_dict.keys():
-                    if key in t:
-                        orig = key
-                        typeset = r"{}".format(custom_latex_md_dict[key])
-                        tmp = t.split(orig)
-                        out = typeset.join(tmp)
-                        arr[i] = out
-                        t = out
-
-            if r"\_\{" in t:
-                tmp = t.split(r"\_\{")
-                out = ""
-                pre = tmp[0]
-                for j in range(len(tmp)):
-                    if j < len(tmp) - 1:
-                        subs = tmp[j + 1].split("\}")[0]
-                        out += pre + r"\ensuremath{_{\mathrm{" + subs + r"}}}"
-                        try:
-                            pre = "}".join(tmp[j + 1].split("\}")[1:])
-                        except ValueError:
-                            pre = ""
-                    else:
-                        out += pre
-                arr[i] = out
-                t = out
 
-        return arr
+class MupLazy(Markup):
+    """Markup that isn't built until it's first rendered: `factory` is called
+    then, with no arguments, to produce the real thing."""
 
-    def _html(self):
-        arr = [html_escape(self.text)]
-
-        for i, t in enumerate(arr):
-            if custom_html_md_dict is not None:
-                for key in custom_html_md_dict.keys():
-                    if key in t:
-                        orig = key
-                        typeset = r"{}".format(custom_html_md_dict[key])
-                        tmp = t.split(orig)
-                        out = typeset.join(tmp)
-                        arr[i] = out
-                        t = out
-            if r"_{" in t:
-                tmp = t.split(r"_{")
-                out = ""
-                pre = tmp[0]
-                for j in range(len(tmp)):
-                    if j < len(tmp) - 1:
-                        subs = tmp[j + 1].split("}")[0]
-                        out += pre + r"<sub>" + subs + r"</sub>"
-                        try:
-                            pre = "}".join(tmp[j + 1].split("}")[1:])
-                        except ValueError:
-                            pre = ""
-                    else:
-                        out += pre
-                arr[i] = out
-                t = out
-            #
-            # if r"{\alpha}" in t:
-            #     tmp = t.split(r"{\alpha}")
-            #     out = "\u03b1".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if r"{\lesssim}" in t:
-            #     tmp = t.split(r"{\lesssim}")
-            #     out = "\u2272".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if r"--" in t:
-            #     tmp = t.split(r"--")
-            #     out = r"-".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if "$" in t:
-            #     tmp = t.split("$")
-            #     out = r"".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if r"\sim" in t:
-            #     tmp = t.split(r"\sim")
-            #     out = r"~".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if r"{\tilde}" in t:
-            #     tmp = t.split(r"{\tilde}")
-            #     out = r"~".join(tmp)
-            #     arr[i] = out
-            #     t = out
-            # if r"\tilde" in t:
-            #     tmp = t.split(r"\tilde")
-            #     out = r"~".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if r"{}" in t:
-            #     out = "".join(t.split(r"{}"))
-            #     arr[i] = out
-            #     t = out
-
-        return arr
+    def __init__(self, factory):
+        self.factory = factory
+        self.inner = None
 
-    def _markdown(self):
-        # return self._html()
-
-        arr = [html_escape(self.text)]
-
-        for i, t in enumerate(arr):
-            if custom_markdown_md_dict is not None:
-                for key in custom_markdown_md_dict.keys():
-                    if key in t:
-                        orig = key
-                        typeset = r"{}".format(custom_markdown_md_dict[key])
-                        tmp = t.split(orig)
-                        out = typeset.join(tmp)
-                        arr[i] = out
-                        t = out
-            if r"_{" in t:
-                tmp = t.split(r"_{")
-                out = ""
-                pre = tmp[0]
-                for j in range(len(tmp)):
-                    if j < len(tmp) - 1:
-                        subs = tmp[j + 1].split("}")[0]
-                        out += pre + r"<sub>" + subs + r"</sub>"
-                        try:
-                            pre = "}".join(tmp[j + 1].split("}")[1:])
-                        except ValueError:
-                            pre = ""
-                    else:
-                        out += pre
-                arr[i] = out
-                t = out
-            #
-            # if r"{\alpha}" in t:
-            #     tmp = t.split(r"{\alpha}")
-            #     out = "\u03b1".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if r"{\lesssim}" in t:
-            #     tmp = t.split(r"{\lesssim}")
-            #     out = "\u2272".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if r"--" in t:
-            #     tmp = t.split(r"--")
-            #     out = r"-".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if "$" in t:
-            #     tmp = t.split("$")
-            #     out = r"".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if r"\sim" in t:
-            #     tmp = t.split(r"\sim")
-            #     out = r"~".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if r"{\tilde}" in t:
-            #     tmp = t.split(r"{\tilde}")
-            #     out = r"~".join(tmp)
-            #     arr[i] = out
-            #     t = out
-            # if r"\tilde" in t:
-            #     tmp = t.split(r"\tilde")
-            #     out = r"~".join(tmp)
-            #     arr[i] = out
-            #     t = out
-
-            # if r"{}" in t:
-            #     out = "".join(t.split(r"{}"))
-            #     arr[i] = out
-            #     t = out
-
-        return arr
+    def _write(self, fmt, write):
+        if self.inner is None:
+            self.inner = _maybe_wrap_text(self.factory())
+        self.inner._write(fmt, write)
+
+
+# Many constructs are rendered into Markdown as HTML, contents and all.
 
 
 class MupItalics(Markup):
     def __init__(self, inner):
         self.inner = _maybe_wrap_text(inner)
 
-    def _latex(self):
-        return ["\\textit{"] + self.inner._latex() + ["}"]
-
-    def _html(self):
-        return ["<i>"] + self.inner._html() + ["</i>"]
-
-    def _markdown(self):
-        return self._html()
+    def _write(self, fmt, write):
+        if fmt == "latex":
+            write("\\textit{")
+            self.inner._write(fmt, write)
+            write("}")
+        else:
+            write("<i>")
+            self.inner._write("html", write)
+            write("</i>")
 
 
 class MupBold(Markup):
     def __init__(self, inner):
         self.inner = _maybe_wrap_text(inner)
 
-    def _latex(self):
-        return ["\\textbf{"] + self.inner._latex() + ["}"]
-
-    def _html(self):
-        return ["<b>"] + self.inner._html() + ["</b>"]
-
-    def _markdown(self):
-        return ["**"] + self.inner._html() + ["**"]
+    def _write(self, fmt, write):
+        if fmt == "latex":
+            write("\\textbf{")
+            self.inner._write(fmt, write)
+            write("}")
+        elif fmt == "html":
+            write("<b>")
+            self.inner._write(fmt, write)
+            write("</b>")
+        else:
+            write("**")
+            self.inner._write("html", write)
+            write("**")
 
 
 class MupBoldUnderline(Markup):
     def __init__(self, inner):
         self.inner = _maybe_wrap_text(inner)
 
-    def _latex(self):
-        return (
-            ["\\underline{\\smash{\\textbf{"] + self.inner._latex() + ["}}}"]
-        )
-
-    def _html(self):
-        return ["<u>"] + ["<b>"] + self.inner._html() + ["</b>"] + ["</u>"]
-
-    def _markdown(self):
-        return ["<ins>"] + ["**"] + self.inner._html() + ["**"] + ["</ins>"]
+    def _write(self, fmt, write):
+        if fmt == "latex":
+            write("\\underline{\\smash{\\textbf{")
+            self.inner._write(fmt, write)
+            write("}}}")
+        elif fmt == "html":
+            write("<u><b>")
+            self.inner._write(fmt, write)
+            write("</b></u>")
+        else:
+            write("<ins>**")
+            self.inner._write("html", write)
+            write("**</ins>")
 
 
 class MupDagger(Markup):
     def __init__(self, inner):
         self.inner = _maybe_wrap_text(inner)
 
-    def _latex(self):
-        return ["$^{\dag}$"] + self.inner._latex() + [""]
-
-    def _html(self):
-        return ["<sup>&#8224;</sup>"] + self.inner._html() + [""]
-
-    def _markdown(self):
-        return self._html()
+    def _write(self, fmt, write):
+        if fmt == "latex":
+            write("$^{\dag}$")
+            self.inner._write(fmt, write)
+        else:
+            write("<sup>&#8224;</sup>")
+            self.inner._write("html", write)
 
 
 class MupAsterisk(Markup):
     def __init__(self, inner):
         self.inner = _maybe_wrap_text(inner)
 
-    def _latex(self):
-        return ["*"] + self.inner._latex() + [""]
-
-    def _html(self):
-        return ["*"] + self.inner._html() + [""]
-
-    def _markdown(self):
-        return self._html()
+    def _write(self, fmt, write):
+        write("*")
+        if fmt == "latex":
+            self.inner._write(fmt, write)
+        else:
+            self.inner._write("html", write)
 
 
 class MupUnderline(Markup):
     def __init__(self, inner):
         self.inner = _maybe_wrap_text(inner)
 
-    def _latex(self):
-        return ["\\underline{"] + self.inner._latex() + ["}"]
-
-    def _html(self):
-        return ["<u>"] + self.inner._html() + ["</u>"]
-
-    def _markdown(self):
-        return self._html()
+    def _write(self, fmt, write):
+        if fmt == "latex":
+            write("\\underline{")
+            self.inner._write(fmt, write)
+            write("}")
+        else:
+            write("<u>")
+            self.inner._write("html", write)
+            write("</u>")
 
 
 class MupLink(Markup):
@@ -599,27 +996,25 @@ class MupLink(Markup):
         self.url = str(url)
         self.inner = _maybe_wrap_text(inner)
 
-    def _latex(self):
-        return (
-            ["\\href{", self.url.replace("%", "\\%"), "}{"]
-            + self.inner._latex()
-            + ["}"]
-        )
-
-    def _html(self):
-        return (
-            ['<a href="', html_escape(self.url), '">']
-            + self.inner._html()
-            + ["</a>"]
-        )
-
-    def _markdown(self):
-        return (
-            ["["]
-            + self.inner._html()
-            + ["]"]
-            + ["(", html_escape(self.url), ")"]
-        )
+    def _write(self, fmt, write):
+        if fmt == "latex":
+            write("\\href{")
+            write(self.url.replace("%", "\\%"))
+            write("}{")
+            self.inner._write(fmt, write)
+            write("}")
+        elif fmt == "html":
+            write('<a href="')
+            write(html_escape(self.url))
+            write('">')
+            self.inner._write(fmt, write)
+            write("</a>")
+        else:
+            write("[")
+            self.inner._write("html", write)
+            write("](")
+            write(html_escape(self.url))
+            write(")")
 
 
 class MupJoin(Markup):
@@ -627,50 +1022,16 @@ class MupJoin(Markup):
         self.sep = _maybe_wrap_text(sep)
         self.items = [_maybe_wrap_text(i) for i in items]
 
-    def _latex(self):
-        esep = self.sep._latex()
-        result = []
-        first = True
+    def _write(self, fmt, write):
+        esep = None
 
         for i in self.items:
-            if first:
-                first = False
+            if esep is None:
+                esep = "".join(self.sep._fragments(fmt))
             else:
-                result += esep
-
-            result += i._latex()
-
-        return result
+                write(esep)
 
-    def _html(self):
-        esep = self.sep._html()
-        result = []
-        first = True
-
-        for i in self.items:
-            if first:
-                first = False
-            else:
-                result += esep
-
-            result += i._html()
-
-        return result
-
-    def _markdown(self):
-        esep = self.sep._markdown()
-        result = []
-        first = True
-
-        for i in self.items:
-            if first:
-                first = False
-            else:
-                result += esep
-
-            result += i._markdown()
-
-        return result
+            i._write(fmt, write)
 
 
 # SHP-added
@@ -679,27 +1040,9 @@ class MupPrepend(Markup):
         self.pre = _maybe_wrap_text(pre)
         self.Mup = Mup
 
-    def _latex(self):
-        result = []
-
-        result += self.pre._latex()
-        result += self.Mup._latex()
-
-        return result
-
-    def _html(self):
-        result = []
-
-        result += self.pre._html()
-        result += self.Mup._html()
-        return result
-
-    def _markdown(self):
-        result = []
-
-        result += self.pre._markdown()
-        result += self.Mup._markdown()
-        return result
+    def _write(self, fmt, write):
+        self.pre._write(fmt, write)
+        self.Mup._write(fmt, write)
 
 
 class MupList(Markup):
@@ -707,62 +1050,63 @@ class MupList(Markup):
         self.ordered = bool(ordered)
         self.items = [_maybe_wrap_text(i) for i in items]
 
-    def _latex(self):
-        if self.ordered:
-            res = ["\\begin{enumerate}"]
-        else:
-            res = ["\\begin{itemize}"]
-
-        for i in self.items:
-            res.append("\n\\item ")
-            res += i._latex()
-
-        if self.ordered:
-            res.append("\n\\end{enumerate}\n")
-        else:
-            res.append("\n\\end{itemize}\n")
-
-        return res
-
-    def _html(self):
-        if self.ordered:
-            res = ["<ol>"]
+    def _write(self, fmt, write):
+        if fmt == "latex":
+            if self.ordered:
+                env = "enumerate"
+            else:
+                env = "itemize"
+
+            write("\\begin{%s}" % env)
+            for i in self.items:
+                write("\n\\item ")
+                i._write(fmt, write)
+            write("\n\\end{%s}\n" % env)
+        elif fmt == "html":
+            if self.ordered:
+                tag = "ol"
+            else:
+                tag = "ul"
+
+            write("<%s>" % tag)
+            for i in self.items:
+                write("\n<li>")
+                i._write(fmt, write)
+                write("</li>")
+            write("\n</%s>\n" % tag)
         else:
-            res = ["<ul>"]
-
-        for i in self.items:
-            res.append("\n<li>")
-            res += i._html()
-            res.append("</li>")
+            if self.ordered:
+                bullet = "\n1. "
+            else:
+                bullet = "\n+ "
 
-        if self.ordered:
-            res.append("\n</ol>\n")
-        else:
-            res.append("\n</ul>\n")
+            for i in self.items:
+                write(bullet)
+                i._write("html", write)
+            write("\n")
 
-        return res
 
-    def _markdown(self):
-        res = []
-        for i in self.items:
-            if self.ordered:
-                res.append("\n1. ")
-            else:
-                res.append("\n+ ")
-            res += i._html()
+# Plain strings passed to the render functions are memoized too.
+_render_latex_text = lru_cache(maxsize=TEXT_CACHE_SIZE)(
+    unicode_to_latex_string
+)
+_render_html_text = lru_cache(maxsize=TEXT_CACHE_SIZE)(html_escape)
 
-        res.append("\n")
 
-        return res
+# Markdown text also goes through the custom rules, so the memo is keyed by the
+# current rewriter as well; entries made with outdated ones just age out.
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def _render_markdown_text(rewrite, value):
+    return rewrite(value)
 
 
 def render_latex(value):
     if isinstance(value, int):
         return str(value)
     if isinstance(value, text_type):
-        return unicode_to_latex_string(value)
+        return _render_latex_text(value)
     if isinstance(value, string_types):
-        return unicode_to_latex_string(text_type(value))
+        return _render_latex_text(text_type(value))
     if isinstance(value, Markup):
         return value.latex()
     raise ValueError("don't know how to render %r into latex" % value)
@@ -772,9 +1116,9 @@ def render_html(value):
     if isinstance(value, int):
         return str(value)
     if isinstance(value, text_type):
-        return html_escape(value)
+        return _render_html_text(value)
     if isinstance(value, string_types):
-        return html_escape(text_type(value))
+        return _render_html_text(text_type(value))
     if isinstance(value, Markup):
         return value.html()
     raise ValueError("don't know how to render %r into HTML" % value)
@@ -784,11 +1128,9 @@ def render_markdown(value):
     if isinstance(value, int):
         return str(value)
     if isinstance(value, str):
-        rend = MupText(value)
-        return rend.markdown()
+        return _render_markdown_text(text_rewriter("markdown"), value)
     if isinstance(value, bytes):
-        rend = MupText(str(value))
-        return rend.markdown()
+        return _render_markdown_text(text_rewriter("markdown"), str(value))
     if isinstance(value, Markup):
         return value.markdown()
     raise ValueError("don't know how to render %r into MARKDOWN" % value)
@@ -805,68 +1147,220 @@ class Formatter(object):
 
        <a href="http://...">http://...</a>
 
-    This particular tactic is needed to work with textual URLs in LaTeX, since
-    the \\url{} and \\href{} commands redefine character codes such that the
-    standard LaTeX escaping mechanism is inappropriate. In particular, URLs
-    with tildes were breaking.
+    This particular tactic is needed to work with textual URLs in LaTeX, since
+    the \\url{} and \\href{} commands redefine character codes such that the
+    standard LaTeX escaping mechanism is inappropriate. In particular, URLs
+    with tildes were breaking.
+
+    Formatters are compiled when they're created: the substitutions are
+    turned into functions that fetch and render their fields directly. Use
+    `get_formatter` to share them.
+
+    """
+
+    def __init__(self, renderer, israw, text):
+        from re import split
+
+        pieces = split(r"(\|[^|]+\|)", text)
+
+        def process(piece):
+            if len(piece) and piece[0] == "|":
+                return True, piece[1:-1]
+            return False, piece
+
+        self.tmplinfo = tuple(process(p) for p in pieces)
+        self.renderer = renderer
+        self.israw = israw
+
+        # The names of the item fields that the template refers to.
+        self.fields = frozenset(
+            text[8:] if text.startswith("texturl:") else text
+            for issubst, text in self.tmplinfo
+            if issubst
+        )
+
+        # The output is built from a copy of `_parts`, into which the
+        # substitutions (and non-raw literals, which are rendered at call time
+        # in case the text rewriting rules change) are written.
+        self._parts = []
+        self._substs = []
+        self._literals = []
+
+        for issubst, text in self.tmplinfo:
+            if issubst:
+                self._substs.append(
+                    (len(self._parts), text, _field_renderer(renderer, text))
+                )
+                self._parts.append(None)
+            elif israw:
+                self._parts.append(text)
+            else:
+                self._literals.append((len(self._parts), text))
+                self._parts.append(None)
+
+    def __call__(self, item):
+        out = self._parts[:]
+
+        for i, text in self._literals:
+            out[i] = self.renderer(text)
+
+        for i, text, render_field in self._substs:
+            try:
+                out[i] = render_field(item)
+            except ValueError as e:
+                raise ValueError(
+                    (
+                        'while rendering field "%s" of item %s: %s'
+                        % (text, item, e)
+                    ).encode("utf-8")
+                )
+
+        return "".join(out)
+
+
+# Plain strings are by far the commonest field values, so compiled Formatters
+# render them straight through the cached text renderers when they can.
+
+_text_renderers = {
+    render_latex: _render_latex_text,
+    render_html: _render_html_text,
+}
+
+
+def _field_renderer(renderer, text):
+    if text.startswith("texturl:"):
+        name = text[8:]
+
+        def render_field(item):
+            thing = item.get(name)
+            return renderer(MupLink(thing, thing))
+
+        return render_field
+
+    render_text = _text_renderers.get(renderer)
+
+    if render_text is None:
+
+        def render_field(item):
+            return renderer(item.get(text))
+
+        return render_field
+
+    def render_field(item):
+        value = item.get(text)
+        if value.__class__ is str:
+            return render_text(value)
+        return renderer(value)
+
+    return render_field
+
 
-    """
+FORMATTER_CACHE_SIZE = 256
 
-    def __init__(self, renderer, israw, text):
-        from re import split
 
-        pieces = split(r"(\|[^|]+\|)", text)
+@lru_cache(maxsize=FORMATTER_CACHE_SIZE)
+def get_formatter(renderer, israw, text):
+    """Return a Formatter for `text`. Formatters are shared between all the
+    commands and template lines that use the same template text and
+    renderer."""
+    return Formatter(renderer, israw, text)
 
-        def process(piece):
-            if len(piece) and piece[0] == "|":
-                return True, piece[1:-1]
-            return False, piece
 
-        self.tmplinfo = [process(p) for p in pieces]
-        self.renderer = renderer
-        self.israw = israw
+# Info builders like `cite_info` add a lot of derived fields to an item, most
+# of which a given template won't use. So they return LazyHolders, which only
+# derive a field when it's looked up.
 
-    def _handle_one(self, tmpldata, item):
-        issubst, text = tmpldata
 
-        if not issubst:
-            if self.israw:
-                return text
-            return self.renderer(text)
+def _derivers(*groups):
+    """Build a table mapping field names to the functions that derive them,
+    from pairs of a function and a space-separated list of the fields that it
+    sets."""
+    return dict(
+        (name, func) for func, names in groups for name in names.split()
+    )
 
-        try:
-            if text.startswith("texturl:"):
-                thing = item.get(text[8:])
-                thing = MupLink(thing, thing)
-            else:
-                thing = item.get(text)
-            return self.renderer(thing)
-        except ValueError as e:
-            raise ValueError(
-                (
-                    'while rendering field "%s" of item %s: %s'
-                    % (text, item, e)
-                ).encode("utf-8")
-            )
 
-    def __call__(self, item):
-        return "".join(self._handle_one(d, item) for d in self.tmplinfo)
+class LazyHolder(Holder):
+    """A Holder with the fields of `item` plus fields derived from it. The
+    function `derivers[name]` is called as `func(item, self, *args)` the first
+    time that field `name` is looked up, and should set it (and perhaps some
+    others) on `self`. A deriver that doesn't set its field leaves the value
+    from `item`, if any, visible."""
+
+    def __init__(self, item, derivers, *args):
+        self._lazy_item = item
+        self._lazy_derivers = derivers
+        self._lazy_args = args
+        self._lazy_done = set()
+
+    def get(self, name, defval=None):
+        d = self.__dict__
+        if name in d:
+            return d[name]
+
+        derive = self._lazy_derivers.get(name)
+        if derive is not None and derive not in self._lazy_done:
+            derive(self._lazy_item, self, *self._lazy_args)
+            self._lazy_done.add(derive)
+            if name in d:
+                return d[name]
+
+        return self._lazy_item.get(name, defval)
+
+    def __getattr__(self, name):
+        if name.startswith("_lazy_"):
+            raise AttributeError(name)
+
+        value = self.get(name, _no_default)
+        if value is _no_default:
+            raise AttributeError(name)
+        return value
+
+    def has(self, name):
+        return self.get(name, _no_default) is not _no_default
+
+    def copy(self):
+        new = object.__new__(self.__class__)
+        new.__dict__ = dict(self.__dict__)
+        new._lazy_done = set(self._lazy_done)
+        return new
+
+    def iteritems(self):
+        for name in self._lazy_derivers:
+            self.get(name)
+
+        d = self.__dict__
+
+        for k, v in self._lazy_item.iteritems():
+            if k not in d:
+                yield k, v
+
+        for k, v in d.items():
+            if k[0] == "_" or v is None:
+                continue
+            yield k, v
+
+    def __str__(self):
+        s = sorted(self.iteritems())
+        return "{" + ", ".join("%s=%s" % kv for kv in s) + "}"
+
+    def __repr__(self):
+        s = sorted(self.iteritems())
+        return "%s(%s)" % (
+            self.__class__.__name__,
+            ", ".join("%s=%r" % kv for kv in s),
+        )
 
 
 # Utilities for dealing with publications.
 
 
 def parse_ads_cites(pub):
-    from time import mktime
-
     if not pub.has("adscites"):
         return None
 
     try:
-        a = pub.adscites.split()[:2]
-        y, m, d = [int(x) for x in a[0].split("/")]
-        lastupdate = int(mktime((y, m, d, 0, 0, 0, 0, 0, 0)))
-        cites = int(a[1])
+        lastupdate, cites = typed(pub, "adscites")
     except Exception:
         warn('cannot parse adscites entry "%s"', pub.adscites)
         return None
@@ -913,6 +1407,71 @@ def canonicalize_name(name):
     return nameout
 
 
+class AuthorList(object):
+    """The authors of a publication, as a sequence of canonicalized names (see
+    `canonicalize_name`), with my name (index `myidx`) in bold and underlined
+    and my advisees (indices `advpos`) daggered. Names are only processed
+    when they're looked up, since long author lists are usually truncated for
+    display."""
+
+    def __init__(self, names, myidx, advpos):
+        self.names = names
+        self.myidx = myidx
+        self._me = self._check_index(myidx)
+        self._daggers = {}
+        self._cache = {}
+
+        for i in advpos:
+            i = self._check_index(i)
+            self._daggers[i] = self._daggers.get(i, 0) + 1
+
+    def _check_index(self, i):
+        n = len(self.names)
+        if i < -n or i >= n:
+            raise IndexError("author index %d out of range" % i)
+        return i % n
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        for i in range(len(self.names)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.names)))]
+
+        i = self._check_index(i)
+        result = self._cache.get(i)
+
+        if result is None:
+            result = canonicalize_name(self.names[i])
+            if i == self._me:
+                result = MupBoldUnderline(result)
+            for _ in range(self._daggers.get(i, 0)):
+                result = MupDagger(result)
+            self._cache[i] = result
+
+        return result
+
+    def short_name(self, i, abbrev=None):
+        """Return the surname of author `i`, or `abbrev` if it's not None,
+        daggered if appropriate."""
+
+        i = self._check_index(i)
+
+        if abbrev is None:
+            result = surname(self.names[i])
+        else:
+            result = abbrev
+
+        for _ in range(self._daggers.get(i, 0)):
+            result = MupDagger(result)
+
+        return result
+
+
 def surname(name):
     return name.strip().split()[-1].replace("_", " ")
 
@@ -939,214 +1498,143 @@ def best_url(item):
     return None
 
 
-def cite_info(oitem, context):
-    """Create a Holder with citation text from a publication item. This can
-    then be fed into a template however one wants. The various computed fields
-    are Unicode or Markups.
+def _my_author_index(oitem, nauths):
+    mypos = typed(oitem, "mypos")
+    if mypos < 0:
+        return nauths + mypos
+    if mypos == 0:
+        die("illegal mypos value %r" % (oitem.mypos,))
+    return mypos - 1
 
-    `oitem` = original item; not to be modified
-    `aitem` = augmented item; = oitem + new fields
-    """
 
-    aitem = oitem.copy()
+def _cite_author_list(oitem, aitem):
+    # Canonicalized authors with bolding of self and underlining of advisees,
+    # shared by the various author fields. Only the ones that actually get
+    # displayed are processed.
+    cauths = aitem.get("_author_list")
 
-    # Canonicalized authors with bolding of self and underlining of advisees.
-    cauths = [canonicalize_name(a) for a in oitem.authors.split(";")]
+    if cauths is None:
+        names = oitem.authors.split(";")
+        myidx = _my_author_index(oitem, len(names))
+        cauths = AuthorList(names, myidx, typed(oitem, "advpos", ()))
+        aitem._author_list = cauths
+
+    return cauths
 
-    mypos = int(oitem.mypos)
-    if mypos < 0:
-        myidx = len(cauths) + mypos
-    elif mypos == 0:
-        die("illegal mypos value %r" % (oitem.mypos,))
-    else:
-        myidx = mypos - 1
-    # cauths[myidx] = MupBold (cauths[myidx])
-    cauths[myidx] = MupBoldUnderline(cauths[myidx])
 
-    advposlist = oitem.get("advpos", "")
-    if len(advposlist):
-        for i in [int(x) - 1 for x in advposlist.split(",")]:
-            # cauths[i] = MupUnderline(cauths[i])
-            cauths[i] = MupDagger(cauths[i])
+def _cite_full_authors(oitem, aitem, context):
+    cauths = _cite_author_list(oitem, aitem)
+    nauths = len(cauths)
 
-    aitem.full_authors = MupJoin(", ", cauths)
+    aitem.full_authors = MupLazy(lambda: MupJoin(", ", list(cauths)))
 
     # --------------------------------------------------------------
     # Make a full authors list with semicolons and & at end:
-    if len(cauths) == 1:
-        aitem.full_authors_semi = cauths[0]
-    if len(cauths) == 2:
-        aitem.full_authors_semi = MupJoin(" & ", cauths)
+    if nauths == 2:
+        aitem.full_authors_semi = MupJoin(" & ", list(cauths))
     else:
-        aitem.full_authors_semi = MupJoin("; ", cauths[:-1])
-        aitem.full_authors_semi = MupJoin(
-            "; & ", [aitem.full_authors_semi, cauths[-1]]
+        aitem.full_authors_semi = MupLazy(
+            lambda: MupJoin("; & ", [MupJoin("; ", cauths[:-1]), cauths[-1]])
         )
 
-    # --------------------------------------------------------------
 
+def _cite_short_authors(oitem, aitem, context):
     # Short list of authors, possibly abbreviating my name.
-    sauths = [surname(a) for a in oitem.authors.split(";")]
-    if context.my_abbrev_name is not None:
-        sauths[myidx] = context.my_abbrev_name
-
-    if len(advposlist):
-        for i in [int(x) - 1 for x in advposlist.split(",")]:
-            # sauths[i] = MupUnderline(sauths[i])
-            sauths[i] = MupDagger(sauths[i])
-
-    # --------------------------------------------------------------
     # Like canonicalized name scheme instead:
-    if len(sauths) == 1:
-        aitem.short_authors = cauths[0]  # sauths[0]
-    elif len(sauths) == 2:
-        aitem.short_authors = MupJoin(" & ", cauths)  # sauths)
-    elif (len(sauths) >= 3) & (len(sauths) <= 5):
-        aitem.short_authors = MupJoin(", ", cauths[:-1])  # sauths)
+    cauths = _cite_author_list(oitem, aitem)
+    nauths = len(cauths)
+    myidx = cauths.myidx
+    abbrev = context.my_abbrev_name
+
+    if nauths == 1:
+        aitem.short_authors = cauths[0]
+    elif nauths == 2:
+        aitem.short_authors = MupJoin(" & ", list(cauths))
+    elif (nauths >= 3) & (nauths <= 5):
+        aitem.short_authors = MupJoin(", ", cauths[:-1])
         aitem.short_authors = MupJoin(
             ", & ", [aitem.short_authors, cauths[-1]]
         )
     else:
-        # aitem.short_authors = MupJoin (' ', [sauths[0], 'et' + nbsp + 'al.'])
         sauthsstr = MupJoin(", ", cauths[0:3])
         aitem.short_authors = MupJoin(", ", [sauthsstr, "et" + nbsp + "al."])
 
-        if (context.my_abbrev_name is not None) & (myidx > 2):
-            # sauths[myidx] = MupBold(sauths[myidx])
-            sauths[myidx] = MupBoldUnderline(sauths[myidx])
+        if (abbrev is not None) & (myidx > 2):
+            smyname = MupBoldUnderline(cauths.short_name(myidx, abbrev))
             sauthsstr = aitem.short_authors
             aitem.short_authors = MupJoin(", ", [sauthsstr, "including "])
             sauthsstr = aitem.short_authors
-            aitem.short_authors = MupJoin(" ", [sauthsstr, sauths[myidx]])
-
-    # --------------------------------------------------------------
-
-    # Short list of authors, for IN PREP PUBLICATIONS: possibly abbreviating
-    # my name.
-    sprepauths = [surname(a) for a in oitem.authors.split(";")]
-    if context.my_abbrev_name is not None:
-        sprepauths[myidx] = context.my_abbrev_name
-
-    if len(advposlist):
-        for i in [int(x) - 1 for x in advposlist.split(",")]:
-            # sprepauths[i] = MupUnderline (sprepauths[i])
-            sprepauths[i] = MupDagger(sprepauths[i])
-
-    # Like canonicalized name scheme instead:
-    if len(sprepauths) == 1:
-        sprepauthsstr = cauths[0]
-        aitem.short_prep_authors = MupJoin(
-            ", ", [sprepauthsstr, "et" + nbsp + "al."]
-        )
-    elif len(sprepauths) == 2:
-        sprepauthsstr = MupJoin(", ", cauths[0:2])
-        aitem.short_prep_authors = MupJoin(
-            ", ", [sprepauthsstr, "et" + nbsp + "al."]
-        )
-    elif len(sprepauths) >= 3:
-        sprepauthsstr = MupJoin(", ", cauths[0:3])
-        aitem.short_prep_authors = MupJoin(
-            ", ", [sprepauthsstr, "et" + nbsp + "al."]
-        )
+            aitem.short_authors = MupJoin(" ", [sauthsstr, smyname])
 
-        if (context.my_abbrev_name is not None) & (myidx > 2):
-            sprepauths[myidx] = MupBold(sprepauths[myidx])
-            sprepauthsstr = aitem.short_prep_authors
-            aitem.short_prep_authors = MupJoin(
-                ", ", [sprepauthsstr, "including "]
-            )
-            sprepauthsstr = aitem.short_prep_authors
-            aitem.short_prep_authors = MupJoin(
-                " ", [sprepauthsstr, sauths[myidx]]
-            )
-
-    # !!!!!!!!!!!!
-    # !!!!
-
-    # --------------------------------------------------------------
 
+def _cite_medium_authors(oitem, aitem, context):
     # Medium list of authors, possibly abbreviating my name.
-    mauths = [surname(a) for a in oitem.authors.split(";")]
-    if context.my_abbrev_name is not None:
-        mauths[myidx] = context.my_abbrev_name
-
-    if len(advposlist):
-        for i in [int(x) - 1 for x in advposlist.split(",")]:
-            mauths[i] = MupDagger(mauths[i])
-
-    # --------------------------------------------------------------
     # Like canonicalized name scheme instead:
-    if len(mauths) == 1:
-        aitem.medium_authors = cauths[0]  # sauths[0]
-    elif len(mauths) == 2:
-        aitem.medium_authors = MupJoin(" & ", cauths)  # sauths)
-    elif (len(mauths) >= 3) & (len(mauths) <= context.num_med_trunc_auths):
-        aitem.medium_authors = MupJoin(", ", cauths[:-1])  # sauths)
+    cauths = _cite_author_list(oitem, aitem)
+    nauths = len(cauths)
+    myidx = cauths.myidx
+    abbrev = context.my_abbrev_name
+    ntrunc = context.num_med_trunc_auths
+
+    if nauths == 1:
+        aitem.medium_authors = cauths[0]
+    elif nauths == 2:
+        aitem.medium_authors = MupJoin(" & ", list(cauths))
+    elif (nauths >= 3) & (nauths <= ntrunc):
+        aitem.medium_authors = MupJoin(", ", cauths[:-1])
         aitem.medium_authors = MupJoin(
             ", & ", [aitem.medium_authors, cauths[-1]]
         )
     else:
-        mauthsstr = MupJoin(", ", cauths[0 : context.num_med_trunc_auths])
+        mauthsstr = MupJoin(", ", cauths[0:ntrunc])
         aitem.medium_authors = MupJoin(", ", [mauthsstr, "et" + nbsp + "al."])
 
-        if (context.my_abbrev_name is not None) & (
-            myidx > context.num_med_trunc_auths - 1
-        ):
-            # mauths[myidx] = MupBold(sauths[myidx])
-            mauths[myidx] = MupBoldUnderline(mauths[myidx])
+        if (abbrev is not None) & (myidx > ntrunc - 1):
+            mmyname = MupBoldUnderline(cauths.short_name(myidx, abbrev))
             mauthsstr = aitem.medium_authors
             aitem.medium_authors = MupJoin(", ", [mauthsstr, "including "])
             mauthsstr = aitem.medium_authors
-            aitem.medium_authors = MupJoin(" ", [mauthsstr, mauths[myidx]])
+            aitem.medium_authors = MupJoin(" ", [mauthsstr, mmyname])
 
-    # --------------------------------------------------------------
 
+def _cite_short_prep_authors(oitem, aitem, context):
     # Short list of authors, for IN PREP PUBLICATIONS: possibly abbreviating
     # my name.
-    sprepauths = [surname(a) for a in oitem.authors.split(";")]
-    if context.my_abbrev_name is not None:
-        sprepauths[myidx] = context.my_abbrev_name
+    cauths = _cite_author_list(oitem, aitem)
+    nauths = len(cauths)
+    myidx = cauths.myidx
+    abbrev = context.my_abbrev_name
 
-    if len(advposlist):
-        for i in [int(x) - 1 for x in advposlist.split(",")]:
-            # sprepauths[i] = MupUnderline (sprepauths[i])
-            sprepauths[i] = MupDagger(sprepauths[i])
-
-    # Like canonicalized name scheme instead:
-    if len(sprepauths) == 1:
+    if nauths == 1:
         sprepauthsstr = cauths[0]
-        aitem.short_prep_authors = MupJoin(
-            ", ", [sprepauthsstr, "et" + nbsp + "al."]
-        )
-    elif len(sprepauths) == 2:
+    elif nauths == 2:
         sprepauthsstr = MupJoin(", ", cauths[0:2])
-        aitem.short_prep_authors = MupJoin(
-            ", ", [sprepauthsstr, "et" + nbsp + "al."]
-        )
-    elif len(sprepauths) >= 3:
+    else:
         sprepauthsstr = MupJoin(", ", cauths[0:3])
-        aitem.short_prep_authors = MupJoin(
-            ", ", [sprepauthsstr, "et" + nbsp + "al."]
-        )
 
-        if (context.my_abbrev_name is not None) & (myidx > 2):
-            sprepauths[myidx] = MupBold(sprepauths[myidx])
-            sprepauthsstr = aitem.short_prep_authors
-            aitem.short_prep_authors = MupJoin(
-                ", ", [sprepauthsstr, "including "]
-            )
-            sprepauthsstr = aitem.short_prep_authors
-            aitem.short_prep_authors = MupJoin(
-                " ", [sprepauthsstr, sauths[myidx]]
-            )
+    aitem.short_prep_authors = MupJoin(
+        ", ", [sprepauthsstr, "et" + nbsp + "al."]
+    )
 
-    # --------------------------------------------------------------
+    if (nauths >= 3) & (abbrev is not None) & (myidx > 2):
+        # Bolded if that happens for `short_authors`.
+        smyname = cauths.short_name(myidx, abbrev)
+        if nauths > 5:
+            smyname = MupBoldUnderline(smyname)
+        sprepauthsstr = aitem.short_prep_authors
+        aitem.short_prep_authors = MupJoin(", ", [sprepauthsstr, "including "])
+        sprepauthsstr = aitem.short_prep_authors
+        aitem.short_prep_authors = MupJoin(" ", [sprepauthsstr, smyname])
 
-    if oitem.refereed == "y":
+
+def _cite_refereed_mark(oitem, aitem, context):
+    if typed(oitem, "refereed"):
         aitem.refereed_mark = "»"
     else:
         aitem.refereed_mark = ""
 
+
+def _cite_titles(oitem, aitem, context):
     # # Title with replaced quotes, for nesting in double-quotes, and
     # # optionally-bolded for first authorship.
     # aitem.quotable_title = oitem.title.replace("“", "‘").replace("”", "’")
@@ -1154,15 +1642,19 @@ def cite_info(oitem, context):
         oitem.title.replace("“", "‘").replace("”", "’")
     )
 
-    if myidx == 0:
+    if _cite_author_list(oitem, aitem).myidx == 0:
         aitem.bold_if_first_title = MupBold(oitem.title)
     else:
         aitem.bold_if_first_title = MupText(oitem.title)
 
+
+def _cite_date(oitem, aitem, context):
     # Pub year and nicely-formatted date
-    aitem.year, aitem.month = list(map(int, oitem.pubdate.split("/")))
+    aitem.year, aitem.month = typed(oitem, "pubdate")
     aitem.pubdate = "%d%s%s" % (aitem.year, nbsp, months[aitem.month - 1])
 
+
+def _cite_count_notes(oitem, aitem, context):
     # Template-friendly citation count
     citeinfo = parse_ads_cites(oitem)
     if citeinfo is not None and citeinfo.cites > 0:
@@ -1174,6 +1666,8 @@ def cite_info(oitem, context):
         # SHP addition:
         aitem.citecountnotelonger = ""
 
+
+def _cite_linked_text(oitem, aitem, context):
     # Citation text with link
     url = best_url(oitem)
     if url is None:
@@ -1189,8 +1683,8 @@ def cite_info(oitem, context):
     else:
         aitem.title_link = MupLink(url, aitem.title)
 
-    # -----------------------
 
+def _cite_other_links(oitem, aitem, context):
     # Other links for the web pub list, individually and as an <ul>
     try:
         from urllib.parse import quote as urlquote
@@ -1227,7 +1721,41 @@ def cite_info(oitem, context):
         link_items.append(aitem.other_link)
 
     aitem.links_list = MupList(False, link_items)
-    return aitem
+
+
+_cite_derivers = _derivers(
+    (_cite_full_authors, "full_authors full_authors_semi"),
+    (_cite_short_authors, "short_authors"),
+    (_cite_medium_authors, "medium_authors"),
+    (_cite_short_prep_authors, "short_prep_authors"),
+    (_cite_refereed_mark, "refereed_mark"),
+    (_cite_titles, "quotable_title bold_if_first_title"),
+    (_cite_date, "year month pubdate"),
+    (_cite_count_notes, "citecountnote citecountnotelonger"),
+    (_cite_linked_text, "lcite title_link"),
+    (
+        _cite_other_links,
+        "abstract_link preprint_link official_link other_link links_list",
+    ),
+)
+
+
+def cite_info(oitem, context):
+    """Create a Holder with citation text from a publication item. This can
+    then be fed into a template however one wants. The various computed fields
+    are Unicode or Markups, and are only computed when they're first looked up
+    (see `LazyHolder`).
+
+    `oitem` = original item; not to be modified
+    `aitem` = augmented item; = oitem + new fields
+    """
+
+    # The settings are captured now, since the fields may be derived later.
+    settings = Holder(
+        my_abbrev_name=context.my_abbrev_name,
+        num_med_trunc_auths=context.num_med_trunc_auths,
+    )
+    return LazyHolder(oitem, _cite_derivers, settings)
 
 
 def compute_cite_stats(pubs, fewsplit=2):
@@ -1266,16 +1794,18 @@ def compute_cite_stats(pubs, fewsplit=2):
         stats.pubs += 1
 
         studentfirstauth = _get_studentfirstauth(pub)
-        if int(pub.mypos) == 1:
+        mypos = typed(pub, "mypos")
+        refereed = typed(pub, "refereed")
+        if mypos == 1:
             stats.firstauth += 1
-        elif int(pub.mypos) == 2:
+        elif mypos == 2:
             stats.secauth += 1
             stats.secauthstudent += 1
         elif studentfirstauth:
             stats.secauthstudent += 1
         # else:
 
-        # # if int(pub.mypos) > fewsplit:
+        # # if mypos > fewsplit:
         # #     stats.contribauth += 1
 
         # if (int(pub.mypos) > fewsplit) & (not studentfirstauth):
@@ -1283,14 +1813,14 @@ def compute_cite_stats(pubs, fewsplit=2):
 
         if studentfirstauth:
             stats.student += 1
-        elif int(pub.mypos) > fewsplit:
+        elif mypos > fewsplit:
             stats.contribauth += 1
 
-        if pub.refereed == "y":
+        if refereed:
             stats.refpubs += 1
-            if int(pub.mypos) == 1:
+            if mypos == 1:
                 stats.reffirstauth += 1
-            elif int(pub.mypos) == 2:
+            elif mypos == 2:
                 stats.refsecauth += 1
                 stats.refsecauthstudent += 1
             elif studentfirstauth:
@@ -1308,12 +1838,12 @@ def compute_cite_stats(pubs, fewsplit=2):
         cites.append(citeinfo.cites)
         dates.append(citeinfo.lastupdate)
 
-        if pub.refereed == "y":
+        if refereed:
             stats.refcites += citeinfo.cites
 
-            if int(pub.mypos) == 1:
+            if mypos == 1:
                 stats.reffirstauthcites += citeinfo.cites
-            elif int(pub.mypos) == 2:
+            elif mypos == 2:
                 stats.refsecauthcites += citeinfo.cites
                 stats.refsecauthstudentcites += citeinfo.cites
             elif studentfirstauth:
@@ -1323,15 +1853,15 @@ def compute_cite_stats(pubs, fewsplit=2):
                 stats.refstudentcites += citeinfo.cites
 
         stats.cites += citeinfo.cites
-        if int(pub.mypos) == 1:
+        if mypos == 1:
             stats.firstauthcites += citeinfo.cites
-        elif int(pub.mypos) == 2:
+        elif mypos == 2:
             stats.secauthcites += citeinfo.cites
             stats.secauthstudentcites += citeinfo.cites
         elif studentfirstauth:
             stats.secauthstudentcites += citeinfo.cites
         # else:
-        # if int(pub.mypos) > fewsplit:
+        # if mypos > fewsplit:
         #     stats.contribauthcites += citeinfo.cites
 
         # if (int(pub.mypos) > fewsplit) & (not studentfirstauth):
@@ -1342,7 +1872,7 @@ def compute_cite_stats(pubs, fewsplit=2):
 
         if studentfirstauth:
             stats.studentcites += citeinfo.cites
-        elif int(pub.mypos) > fewsplit:
+        elif mypos > fewsplit:
             stats.contribauthcites += citeinfo.cites
 
     if not len(cites):
@@ -1387,7 +1917,7 @@ def partition_pubs(pubs, fewsplit=2):
     groups.few_include_student_led = True
 
     for pub in pubs:
-        refereed = pub.refereed == "y"
+        refereed = typed(pub, "refereed")
         refpreprint = pub.get("refpreprint", "n") == "y"
         chapter = pub.get("kind", "default") == "book chapter"
         formal = pub.get("informal", "n") == "n"
@@ -1404,9 +1934,11 @@ def partition_pubs(pubs, fewsplit=2):
         if groups.few_include_student_led:
             studentfirstauth = _get_studentfirstauth(pub)
 
-            firstfew = (int(pub.mypos) <= groups.fewsplit) | (studentfirstauth)
+            firstfew = (typed(pub, "mypos") <= groups.fewsplit) | (
+                studentfirstauth
+            )
         else:
-            firstfew = int(pub.mypos) <= groups.fewsplit
+            firstfew = typed(pub, "mypos") <= groups.fewsplit
 
         if (not prep) & (not prepsub):
             groups.all.append(pub)
@@ -1537,8 +2069,7 @@ def compute_observing_experience(observing):
             facil_desc = obs.facil_desc
             inst = obs.inst
             facil_inst = facil + ": " + inst
-            quantity, units = amount.split()
-            quantity = float(quantity)
+            quantity, units = typed(obs, "time")
         except Exception as e:
             die("error processing outcome of obs <%s>: %s", obs, e)
 
@@ -1602,16 +2133,16 @@ def compute_time_allocations(props):
     allocs = {}
 
     def get_contributions(prop):
-        amount = prop.get("award")
-        if amount is None:
-            amount = prop.get("request")
-        if amount is None:
+        if prop.has("award"):
+            amount = "award"
+        elif prop.has("request"):
+            amount = "request"
+        else:
             die('no "award" or "request" for proposal %s', prop)
 
         try:
             facil1 = prop.facil
-            quantity1, units1 = amount.split()
-            quantity1 = float(quantity1)
+            quantity1, units1 = typed(prop, amount)
         except Exception as e:
             die(
                 "error processing primary outcome of proposal <%s>: %s",
@@ -1645,10 +2176,10 @@ def compute_time_allocations(props):
             i += 1
 
     for prop in props:
-        if prop.get("mepi", "n") != "y":
+        if not typed(prop, "mepi", False):
             continue  # self as PI only
 
-        if prop.get("accepted", "n") != "y":
+        if not typed(prop, "accepted", False):
             continue  # only accepted ones!
 
         for facil, quantity, units in get_contributions(prop):
@@ -1695,28 +2226,19 @@ def compute_time_allocations(props):
 # Utilities for dealing with proposals:
 
 
-def prop_info(oitem):
-    """Create a Holder with citation text from a publication item. This can
-    then be fed into a template however one wants. The various computed fields
-    are Unicode or Markups.
-
-    `oitem` = original item; not to be modified
-    `aitem` = augmented item; = oitem + new fields
-    """
-
-    aitem = oitem.copy()
-    try:
+def _prop_name(oitem, aitem):
+    if oitem.has("name"):
         # Fix name:
-        aitem.name = MupText(aitem.name)
-    except AttributeError:
-        pass
+        aitem.name = MupText(oitem.name)
 
-    try:
+
+def _prop_id(oitem, aitem):
+    if oitem.has("propID"):
         # Fix propIDs:
-        aitem.propID = MupText(aitem.propID)
-    except AttributeError:
-        pass
+        aitem.propID = MupText(oitem.propID)
 
+
+def _prop_pis(oitem, aitem):
     # Canonicalized authors with bolding of self and underlining of advisees.
     # pis = [canonicalize_name (a) for a in oitem.PIs.split (',')]
     pis = [a for a in oitem.PIs.split(",")]
@@ -1727,6 +2249,8 @@ def prop_info(oitem):
         pis_front = "PI: "
     aitem.PIs_str = MupPrepend(pis_front, aitem.PIs)
 
+
+def _prop_cois(oitem, aitem):
     try:
         # cois = [canonicalize_name (a) for a in oitem.coIs.split (',')]
         cois = [a for a in oitem.coIs.split(",")]
@@ -1741,6 +2265,8 @@ def prop_info(oitem):
         aitem.coIs = ""
         aitem.coIs_str = ""
 
+
+def _prop_quotable_title(oitem, aitem):
     try:
         # Title with replaced quotes, for nesting in double-quotes, and
         # optionally-bolded for first authorship.
@@ -1752,21 +2278,47 @@ def prop_info(oitem):
     except AttributeError:
         aitem.quotable_title = ""
 
+
+def _prop_request(oitem, aitem):
     # Test: "prettify" request + award to have commas:
     try:
-        amount = aitem.request
+        amount = oitem.request
         quantity, units = amount.split()
         aitem.request = _quant_to_num_prettify(quantity, units)
     except AttributeError:
         aitem.request = ""
+
+
+def _prop_award(oitem, aitem):
     try:
-        amount = aitem.award
+        amount = oitem.award
         quantity, units = amount.split()
         aitem.award = _quant_to_num_prettify(quantity, units)
     except AttributeError:
         aitem.award = ""
 
-    return aitem
+
+_prop_derivers = _derivers(
+    (_prop_name, "name"),
+    (_prop_id, "propID"),
+    (_prop_pis, "PIs PIs_str"),
+    (_prop_cois, "coIs coIs_str"),
+    (_prop_quotable_title, "quotable_title"),
+    (_prop_request, "request"),
+    (_prop_award, "award"),
+)
+
+
+def prop_info(oitem):
+    """Create a Holder with citation text from a publication item. This can
+    then be fed into a template however one wants. The various computed fields
+    are Unicode or Markups, and are only computed when they're first looked up
+    (see `LazyHolder`).
+
+    `oitem` = original item; not to be modified
+    `aitem` = augmented item; = oitem + new fields
+    """
+    return LazyHolder(oitem, _prop_derivers)
 
 
 # Utilities for dealing with public code repositories
@@ -1782,7 +2334,7 @@ def process_repositories(items):
     for i in items:
         if i.section != "repo":
             continue
-        if i.get("skip", "n") == "y":
+        if typed(i, "skip", False):
             continue
         if i.usercommits == "0":
             continue
@@ -1798,14 +2350,14 @@ def process_repositories(items):
             repo.linkname = i.name
 
         repo.commit_frac = "%.0f%%" % (
-            100.0 * int(i.usercommits) / int(i.allcommits)
+            100.0 * typed(i, "usercommits") / typed(i, "allcommits")
         )
         if repo.commit_frac == "0%":
             repo.commit_frac = "<1%"
 
-        repo.luc_year, repo.luc_month, repo.luc_day = [
-            int(x) for x in i.lastusercommit.split("/")
-        ]
+        repo.luc_year, repo.luc_month, repo.luc_day = typed(
+            i, "lastusercommit"
+        )
         repo.date = "%04d %s" % (repo.luc_year, months[repo.luc_month - 1])
         repo._datekey = (
             repo.luc_year * 10000 + repo.luc_month * 100 + repo.luc_day
@@ -1823,13 +2375,14 @@ def compute_repo_stats(repos):
     pa_forks = 0
 
     for repo in repos:
-        tc += int(repo.usercommits)
+        usercommits = typed(repo, "usercommits")
+        tc += usercommits
 
-        if 2 * int(repo.usercommits) > int(
-            repo.allcommits
+        if 2 * usercommits > typed(
+            repo, "allcommits"
         ):  # >=50% of commits ("primary author")?
-            pa_stars += int(repo.get("stars", "0"))
-            pa_forks += int(repo.get("forks", "0"))
+            pa_stars += typed(repo, "stars", 0)
+            pa_forks += typed(repo, "forks", 0)
 
     info["total_commits"] = tc
     info["primary_author_stars"] = pa_stars
@@ -1843,9 +2396,9 @@ def compute_repo_stats(repos):
 def summarize_talks(talks):
     info = {}
     info["n_total"] = len(talks)
-    info["n_invited"] = len([t for t in talks if t.get("invited", "n") == "y"])
+    info["n_invited"] = len([t for t in talks if typed(t, "invited", False)])
     info["n_conference"] = len(
-        [t for t in talks if t.get("conference", "n") == "y"]
+        [t for t in talks if typed(t, "conference", False)]
     )
     return info
 
@@ -1880,15 +2433,13 @@ class MultilineSubstHandler(MultilineHandler):
 
     def handle_end_span(self, context):
         tmpl = "\n".join(self.lines)
-        return Formatter(context.render, True, tmpl)(self.info)
+        return get_formatter(context.render, True, tmpl)(self.info)
 
 
 #
 def cmd_cite_stats_tex(context, template):
-    info = compute_cite_stats(
-        context.pubgroups.all_formal, fewsplit=context.fewsplit
-    )
-    return Formatter(context.render, True, slurp_template(template))(info)
+    info = _cite_stats_for(context, context.fewsplit)
+    return get_formatter(context.render, True, slurp_template(template))(info)
 
 
 def cmd_begin_subst(context, group):
@@ -1901,7 +2452,9 @@ def cmd_begin_subst(context, group):
 
 def cmd_format(context, *inline_template):
     inline_template = " ".join(inline_template)
-    context.cur_formatter = Formatter(context.render, True, inline_template)
+    context.cur_formatter = get_formatter(
+        context.render, True, inline_template
+    )
 
     # Every time reset alt, flag check:
     context.cur_formatter_alt = None
@@ -1914,7 +2467,7 @@ def cmd_format(context, *inline_template):
 # SHP added
 def cmd_format_alt(context, *inline_template):
     inline_template = " ".join(inline_template)
-    context.cur_formatter_alt = Formatter(
+    context.cur_formatter_alt = get_formatter(
         context.render, True, inline_template
     )
 
@@ -1935,7 +2488,7 @@ def cmd_format_alt_flag_check(context, flag_to_check):
 
 def cmd_format_alt2(context, *inline_template):
     inline_template = " ".join(inline_template)
-    context.cur_formatter_alt2 = Formatter(
+    context.cur_formatter_alt2 = get_formatter(
         context.render, True, inline_template
     )
 
@@ -1976,26 +2529,38 @@ def cmd_talk_list_switch(context, sections, gatefield, case):
     )
 
 
+def _formatters_use(context, fields):
+    """Whether any of the current formatters refers to any of `fields`. If not,
+    items can be passed to them without going through an info builder."""
+    for formatter in (
+        context.cur_formatter,
+        context.cur_formatter_alt,
+        context.cur_formatter_alt2,
+    ):
+        if formatter is not None and not formatter.fields.isdisjoint(fields):
+            return True
+    return False
+
+
 def _rev_talk_list(context, sections, gate):
     if context.cur_formatter is None:
         die("cannot use TALKLIST* command before using FORMAT")
 
     sections = frozenset(sections.split(","))
+    derive = _formatters_use(context, _talk_derivers)
 
-    for item in context.items[::-1]:
-        if item.section not in sections:
-            continue
+    for item in context.by_section.select(sections, reverse=True):
         if not gate(item):
             continue
 
-        info = talk_info(item)
+        info = talk_info(item) if derive else item
 
         doalt = False
         if context.format_alt_flag_check is not None:
-            if context.format_alt_flag_check in item.__dict__.keys():
-                if (
-                    item.__dict__[context.format_alt_flag_check].strip() == ""
-                ) | (item.__dict__[context.format_alt_flag_check] is None):
+            if item.has(context.format_alt_flag_check):
+                if (item.get(context.format_alt_flag_check).strip() == "") | (
+                    item.get(context.format_alt_flag_check) is None
+                ):
                     doalt = True
             else:
                 doalt = True
@@ -2005,16 +2570,11 @@ def _rev_talk_list(context, sections, gate):
             else:
                 doalt2 = False
                 if context.format_alt2_flag_check is not None:
-                    if context.format_alt_flag_check in item.__dict__.keys():
+                    if item.has(context.format_alt_flag_check):
                         if (
-                            item.__dict__[
-                                context.format_alt2_flag_check
-                            ].strip()
+                            item.get(context.format_alt2_flag_check).strip()
                             == ""
-                        ) | (
-                            item.__dict__[context.format_alt2_flag_check]
-                            is None
-                        ):
+                        ) | (item.get(context.format_alt2_flag_check) is None):
                             doalt2 = True
                     else:
                         doalt = True
@@ -2028,24 +2588,25 @@ def _rev_talk_list(context, sections, gate):
             yield context.cur_formatter(info)
 
 
+def _talk_type(oitem, aitem):
+    if oitem.get("invited", "n") == "y" and oitem.has("type"):
+        # Fix type:
+        aitem.type = MupAsterisk(oitem.type)
+
+
+_talk_derivers = _derivers((_talk_type, "type"))
+
+
 def talk_info(oitem):
     """Create a Holder with citation text from a talk item. This can
     then be fed into a template however one wants. The various computed fields
-    are Unicode or Markups.
+    are Unicode or Markups, and are only computed when they're first looked up
+    (see `LazyHolder`).
 
     `oitem` = original item; not to be modified
     `aitem` = augmented item; = oitem + new fields
     """
-
-    aitem = oitem.copy()
-    try:
-        if aitem.get("invited", "n") == "y":
-            # Fix type:
-            aitem.type = MupAsterisk(aitem.type)
-    except AttributeError:
-        pass
-
-    return aitem
+    return LazyHolder(oitem, _talk_derivers)
 
 
 # ---------------------
@@ -2072,6 +2633,22 @@ def cmd_num_med_trunc_auths(context, *text):
     return ""
 
 
+def _shared_cite_info(context, pub):
+    """Return `cite_info(pub, context)`, memoized for the run, since a pub is
+    usually listed in several groups. The memo is keyed on the context
+    settings that `cite_info` uses, and is reset when they change."""
+    settings = (context.my_abbrev_name, context.num_med_trunc_auths)
+    memo = context.cite_info_memo
+
+    if memo is None or memo[0] != settings:
+        memo = context.cite_info_memo = (settings, {})
+
+    info = memo[1].get(id(pub))
+    if info is None:
+        info = memo[1][id(pub)] = cite_info(pub, context)
+    return info
+
+
 def cmd_pub_list(context, group):
     if context.cur_formatter is None:
         die("cannot use PUBLIST command before using FORMAT")
@@ -2080,7 +2657,8 @@ def cmd_pub_list(context, group):
     npubs = len(pubs)
 
     for num, pub in enumerate(pubs):
-        info = cite_info(pub, context)
+        # The numbers go in an overlay, since the info is shared.
+        info = LazyHolder(_shared_cite_info(context, pub), {})
         info.number = num + 1
         info.rev_number = npubs - num
         yield context.cur_formatter(info)
@@ -2143,9 +2721,7 @@ def _rev_misc_list(context, sections, gate):
 
     sections = frozenset(sections.split(","))
 
-    for item in context.items[::-1]:
-        if item.section not in sections:
-            continue
+    for item in context.by_section.select(sections, reverse=True):
         if not gate(item):
             continue
 
@@ -2153,10 +2729,10 @@ def _rev_misc_list(context, sections, gate):
 
         doalt = False
         if context.format_alt_flag_check is not None:
-            if context.format_alt_flag_check in item.__dict__.keys():
-                if (
-                    item.__dict__[context.format_alt_flag_check].strip() == ""
-                ) | (item.__dict__[context.format_alt_flag_check] is None):
+            if item.has(context.format_alt_flag_check):
+                if (item.get(context.format_alt_flag_check).strip() == "") | (
+                    item.get(context.format_alt_flag_check) is None
+                ):
                     doalt = True
             else:
                 doalt = True
@@ -2166,16 +2742,11 @@ def _rev_misc_list(context, sections, gate):
             else:
                 doalt2 = False
                 if context.format_alt2_flag_check is not None:
-                    if context.format_alt_flag_check in item.__dict__.keys():
+                    if item.has(context.format_alt_flag_check):
                         if (
-                            item.__dict__[
-                                context.format_alt2_flag_check
-                            ].strip()
+                            item.get(context.format_alt2_flag_check).strip()
                             == ""
-                        ) | (
-                            item.__dict__[context.format_alt2_flag_check]
-                            is None
-                        ):
+                        ) | (item.get(context.format_alt2_flag_check) is None):
                             doalt2 = True
                     else:
                         doalt = True
@@ -2296,21 +2867,20 @@ def _rev_prop_list(context, sections, gate):
         die("cannot use PROPLIST* command before using FORMAT")
 
     sections = frozenset(sections.split(","))
+    derive = _formatters_use(context, _prop_derivers)
 
-    for item in context.items[::-1]:
-        if item.section not in sections:
-            continue
+    for item in context.by_section.select(sections, reverse=True):
         if not gate(item):
             continue
 
-        info = prop_info(item)
+        info = prop_info(item) if derive else item
 
         doalt = False
         if context.format_alt_flag_check is not None:
-            if context.format_alt_flag_check in item.__dict__.keys():
-                if (
-                    item.__dict__[context.format_alt_flag_check].strip() == ""
-                ) | (item.__dict__[context.format_alt_flag_check] is None):
+            if item.has(context.format_alt_flag_check):
+                if (item.get(context.format_alt_flag_check).strip() == "") | (
+                    item.get(context.format_alt_flag_check) is None
+                ):
                     doalt = True
             else:
                 doalt = True
@@ -2319,16 +2889,11 @@ def _rev_prop_list(context, sections, gate):
             else:
                 doalt2 = False
                 if context.format_alt2_flag_check is not None:
-                    if context.format_alt2_flag_check in item.__dict__.keys():
+                    if item.has(context.format_alt2_flag_check):
                         if (
-                            item.__dict__[
-                                context.format_alt2_flag_check
-                            ].strip()
+                            item.get(context.format_alt2_flag_check).strip()
                             == ""
-                        ) | (
-                            item.__dict__[context.format_alt2_flag_check]
-                            is None
-                        ):
+                        ) | (item.get(context.format_alt2_flag_check) is None):
                             doalt2 = True
                     else:
                         doalt2 = True
@@ -2362,54 +2927,216 @@ def cmd_today_invert(context):
     return context.render(text)
 
 
-def setup_processing(render, datadir, fewsplit=2):
-    context = Holder()
-    context.render = render
-    context.items = list(load(datadir))
+# Figuring out which record sections a template needs, so that the rest
+# needn't be loaded. Values of None mean that the sections are named by the
+# command's first argument.
+
+_command_sections = {
+    "PUBLIST": ("pub",),
+    "TALLOCLIST": ("prop",),
+    "SPLIT_TALLOCLIST": ("prop",),
+    "OBSEXPLIST": ("obs",),
+    "TEAMTALKLIST": ("talk",),
+    "RREPOLIST": None,
+    "RMISCLIST": None,
+    "RMISCLIST_IF": None,
+    "RMISCLIST_IF_NOT": None,
+    "RMISCLIST_CASE": None,
+    "TALKLIST_CASE": None,
+    "PROPLIST": None,
+    "PROPLIST_IF": None,
+    "PROPLIST_IF_NOT": None,
+    "PROPLIST_IF_IF": None,
+    "PROPLIST_IF_NOT_IF": None,
+    "PROPLIST_IF_IF_NOT": None,
+    "PROPLIST_IF_NOT_IF_NOT": None,
+}
+
+_subst_group_sections = {
+    "cite_stats": ("pub",),
+    "repo_stats": ("repo",),
+    "talk_stats": ("talk",),
+    "engagement_stats": ("engagement",),
+}
+
+
+def _need_sections(context, sections):
+    # A `context.sections` of None means that everything is needed.
+    if sections is None:
+        context.sections = None
+    elif context.sections is not None:
+        context.sections.update(sections)
+    return context
+
+
+def _make_sections_preprocessor(fixed):
+    def handler(context, *args):
+        if fixed is not None:
+            return _need_sections(context, fixed)
+        if not len(args):
+            return context  # the command will complain later
+        return _need_sections(context, args[0].split(","))
+
+    return handler
+
+
+def cmd_begin_subst_preprocess(context, *args):
+    if not len(args):
+        return context
+    return _need_sections(context, _subst_group_sections.get(args[0]))
+
+
+def add_sections_preprocessors(commands):
+    """Register preprocessing handlers in `commands` that accumulate the
+    record sections a template uses into `context.sections`, which should
+    start out as an empty set. If the template uses something that we can't
+    account for, `context.sections` becomes None."""
+
+    for name, fixed in _command_sections.items():
+        commands[name] = _make_sections_preprocessor(fixed)
+    commands["BEGIN_SUBST"] = cmd_begin_subst_preprocess
+
+
+class SectionIndex(object):
+    """The records of a datadir grouped by section, in their original order.
+    The lists returned by `get` are shared, so they shouldn't be modified."""
+
+    def __init__(self, items):
+        self._items = {}
+        self._positions = {}
+
+        for pos, item in enumerate(items):
+            section = item.section
+            self._items.setdefault(section, []).append(item)
+            self._positions.setdefault(section, []).append(pos)
+
+    def get(self, section):
+        return self._items.get(section, [])
+
+    def select(self, sections, reverse=False):
+        """Iterate over the records in any of `sections`, in their original
+        order or reversed, touching only the matching records."""
+        from heapq import merge
+
+        sections = [s for s in frozenset(sections) if s in self._items]
+
+        if not len(sections):
+            return iter(())
+
+        if len(sections) == 1:
+            items = self._items[sections[0]]
+            return reversed(items) if reverse else iter(items)
+
+        if reverse:
+            streams = [
+                zip(reversed(self._positions[s]), reversed(self._items[s]))
+                for s in sections
+            ]
+        else:
+            streams = [
+                zip(self._positions[s], self._items[s]) for s in sections
+            ]
+
+        # Positions are unique, so the records themselves are never compared.
+        return (item for pos, item in merge(*streams, reverse=reverse))
 
-    context.fewsplit = fewsplit
 
-    context.pubs = [i for i in context.items if i.section == "pub"]
+# The statistics and derived lists that templates can use are only computed if
+# they're looked up, since most templates only use a few of them. The context
+# is a LazyHolder (over an empty Holder) with these derivers.
 
-    context.pubgroups = partition_pubs(context.pubs, fewsplit=context.fewsplit)
-    context.props = [i for i in context.items if i.section == "prop"]
+
+def _context_pubgroups(base, context, fewsplit):
+    context.pubgroups = partition_pubs(context.pubs, fewsplit=fewsplit)
+
+
+def _context_time_allocs(base, context, fewsplit):
     context.time_allocs = compute_time_allocations(context.props)
-    context.repos = process_repositories(context.items)
-    context.cite_stats = compute_cite_stats(
-        context.pubgroups.all_formal, fewsplit=context.fewsplit
-    )
+
+
+def _context_repos(base, context, fewsplit):
+    context.repos = process_repositories(context.by_section.get("repo"))
+
+
+def _context_cite_stats(base, context, fewsplit):
+    context.cite_stats = _cite_stats_for(context, fewsplit)
+
+
+def _context_repo_stats(base, context, fewsplit):
     context.repo_stats = compute_repo_stats(context.repos)
-    context.talk_stats = summarize_talks(
-        [i for i in context.items if i.section == "talk"]
-    )
+
+
+def _context_talk_stats(base, context, fewsplit):
+    context.talk_stats = summarize_talks(context.by_section.get("talk"))
+
+
+def _context_engagement_stats(base, context, fewsplit):
     context.engagement_stats = summarize_engagement(
-        [i for i in context.items if i.section == "engagement"]
+        context.by_section.get("engagement")
     )
-    context.cur_formatter = None
-    context.cur_formatter_alt = None
-    context.format_alt_flag_check = None
-    context.cur_formatter_alt2 = None
-    context.format_alt2_flag_check = None
 
-    context.my_abbrev_name = None
 
-    # ------------------------
-    # SHP additions:
+def _context_team_talks(base, context, fewsplit):
     context.team_talks = [
         i
-        for i in context.items
-        if ((i.section == "talk") & (i.get("venue", "n") == "team"))
+        for i in context.by_section.get("talk")
+        if i.get("venue", "n") == "team"
     ]
     context.team_talks_counts = compute_team_talks(context.team_talks)
 
-    context.observing = [i for i in context.items if i.section == "obs"]
+
+def _context_obs_exp(base, context, fewsplit):
     context.obs_exp = compute_observing_experience(context.observing)
 
+
+_context_derivers = _derivers(
+    (_context_pubgroups, "pubgroups"),
+    (_context_time_allocs, "time_allocs"),
+    (_context_repos, "repos"),
+    (_context_cite_stats, "cite_stats"),
+    (_context_repo_stats, "repo_stats"),
+    (_context_talk_stats, "talk_stats"),
+    (_context_engagement_stats, "engagement_stats"),
+    (_context_team_talks, "team_talks team_talks_counts"),
+    (_context_obs_exp, "obs_exp"),
+)
+
+
+def _cite_stats_for(context, fewsplit):
+    """The citation stats of the formal pubs for a given `fewsplit`, memoized,
+    since FEWSPLIT can change it partway through a template."""
+    stats = context.cite_stats_memo.get(fewsplit)
+    if stats is None:
+        stats = context.cite_stats_memo[fewsplit] = compute_cite_stats(
+            context.pubgroups.all_formal, fewsplit=fewsplit
+        )
+    return stats
+
+
+def setup_processing(render, datadir, fewsplit=2, jobs=1, predicate=None):
+    context = LazyHolder(Holder(), _context_derivers, fewsplit)
+    context.render = render
+    context.items = list(load(datadir, jobs=jobs, predicate=predicate))
+    context.by_section = index = SectionIndex(context.items)
+
+    context.fewsplit = fewsplit
+
+    context.pubs = index.get("pub")
+    context.props = index.get("prop")
+    context.observing = index.get("obs")
+    context.cite_stats_memo = {}
+
+    context.cur_formatter = None
     context.cur_formatter_alt = None
     context.format_alt_flag_check = None
     context.cur_formatter_alt2 = None
     context.format_alt2_flag_check = None
 
+    context.my_abbrev_name = None
+    context.cite_info_memo = None
+
+    # ------------------------
+    # SHP additions:
     context.num_med_trunc_auths = 10  # DEFAULT for medium truncation
     # ------------------------
 
@@ -2475,48 +3202,109 @@ def _ensure_ads_api_token():
         raise
 
 
-class ADSCountError(Exception):
-    def __init__(self, fmt, *args):
-        super(ADSCountError, self).__init__(fmt % args)
+# The actual talking to ADS is done by a shared `wlads.ADSClient`, and the
+# counts it fetches are remembered in a `wlads.ADSCache` that's shared by all
+# datadirs and processes.
+
+ADS_BATCH_SIZE = 2000  # the most bibcodes that a bigquery accepts
+ADS_CACHE_TTL = 7 * 24 * 3600  # 1 week
+
+_ads_client = None
+_ads_cache = None
+
+
+def get_ads_client():
+    global _ads_client
+
+    if _ads_client is None:
+        from wlads import ADSClient
+
+        _ensure_ads_api_token()
+        _ads_client = ADSClient(ADS_API_TOKEN)
+
+    return _ads_client
 
 
 def get_ads_cite_count(bibcode):
-    import json
-    import requests
-
-    _ensure_ads_api_token()
-    resp = requests.post(
-        "https://api.adsabs.harvard.edu/v1/metrics",
-        headers={"Authorization": "Bearer " + ADS_API_TOKEN},
-        json={"bibcodes": [bibcode], "types": ["citations"]},
-    )
+    return get_ads_client().cite_count(bibcode)
 
-    # Note: we can't pass `stream=True` to requests.post() and then use
-    # `json.load(resp.raw)` here, because resp.raw is not decoded in any way —
-    # if the output is gzip-encoded, we get the gzip. Based on
-    # https://github.com/psf/requests/issues/465 , it looks lke this is just
-    # How It Is.
-    structured = json.loads(resp.text)
 
-    if "Error" in structured:
-        raise ADSCountError(
-            structured.get("Error Info", "unknown ADS API error")
-        )
+def get_ads_cache():
+    global _ads_cache
 
-    # NB, the "citation stats refereed" structure is all zeros for items that
-    # are not themselves refereed.
-    d = structured.get("citation stats", {})
+    if _ads_cache is None:
+        from wlads import ADSCache
 
-    # count = d.get("total number of refereed citations")
-    count = d.get("total number of citations")
+        _ads_cache = ADSCache()
+
+    return _ads_cache
+
+
+def get_ads_cached_counts(bibcodes, max_age=ADS_CACHE_TTL):
+    """Return a dict mapping those of `bibcodes` whose ADS citation counts
+    were fetched, by any process on this machine, within the past `max_age`
+    seconds to tuples `(count, fetched)`, where `fetched` is the Unix time of
+    the fetch."""
+    return get_ads_cache().lookup(bibcodes, max_age)
+
+
+def get_ads_cite_counts(
+    bibcodes,
+    batch_size=ADS_BATCH_SIZE,
+    max_age=ADS_CACHE_TTL,
+    offline=False,
+    on_fetch=None,
+    max_singles=None,
+):
+    """Return a dict mapping each of `bibcodes` to a tuple `(count, fetched)`
+    as in `get_ads_cached_counts`, or to an ADSCountError if its count
+    couldn't be obtained. Counts fetched within the past `max_age` seconds are
+    taken from the cache; the rest are queried from ADS `batch_size` bibcodes
+    at a time, unless `offline`, in which case they are errors and no API
+    token is needed. `on_fetch` and `max_singles` are passed on to
+    `wlads.ADSClient.cite_counts`."""
+
+    import time
+
+    counts = get_ads_cached_counts(bibcodes, max_age)
+    missing = [b for b in bibcodes if b not in counts]
+
+    if not len(missing):
+        return counts
+
+    if offline:
+        for bibcode in missing:
+            counts[bibcode] = ADSCountError("not cached (offline mode)")
+        return counts
+
+    client = get_ads_client()
+    found = client.cite_counts(
+        missing,
+        batch_size,
+        cache=get_ads_cache(),
+        on_fetch=on_fetch,
+        max_singles=max_singles,
+    )
+    now = time.time()
+
+    for bibcode, count in found.items():
+        if isinstance(count, ADSCountError):
+            counts[bibcode] = count
+        else:
+            counts[bibcode] = (count, now)
+
+    for path, (remaining, reset) in list(client.rate_limits.items()):
+        get_ads_cache().store_rate_limit(path, remaining, reset)
+
+    return counts
 
-    if count is None:
-        raise ADSCountError(
-            "ADS Metrics API response does not include expected "
-            "citation metric"
-        )
 
-    return count
+def get_ads_rate_limit(path):
+    """Return the (remaining requests, reset time) of our ADS API quota for
+    the endpoint `path` (e.g. "search/bigquery"), as last reported by ADS to
+    any process on this machine, or None if it isn't known or has since been
+    reset."""
+    return get_ads_cache().rate_limit(path)
 
 
 # Bootstrapping from a BibTeX file. This is currently aimed 100% at